@@ -0,0 +1,257 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import numpy as np
+import cv2
+
+import video_tuber as vt
+
+# ---------------- CONFIG ----------------
+RESOLUTIONS = [(350, 350), (1280, 720), (1920, 1080)]  # Output sizes the filters are measured at
+FILTER_ITERATIONS = 50       # Frames per filter measurement
+DECODE_FRAMES = 240          # Frames read per get_frame measurement
+SWITCH_ITERATIONS = 20       # State switches per switch_state measurement
+END_TO_END_SECONDS = 5.0     # Duration of the unpaced end-to-end loop
+CLIP_SIZE = (1280, 720)      # Resolution of the generated source clips
+CLIP_FRAMES = 90             # Frames per generated clip
+CLIP_FPS = 30
+CLIPS_PER_STATE = 3
+SEED = 1234
+
+
+# ---------------- SYNTHETIC CLIPS ----------------
+def generate_clip(path, size, frames, fps, seed):
+    """Write a clip with moving gradients and noise so the codec has real work to do."""
+    width, height = size
+    rng = np.random.default_rng(seed)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)
+    noise = rng.integers(0, 32, (height, width, 3), dtype=np.uint8)
+    for i in range(frames):
+        frame = np.empty((height, width, 3), dtype=np.uint8)
+        frame[:, :, 0] = (x[None, :] + i * 4) % 256
+        frame[:, :, 1] = (y[:, None] + i * 2) % 256
+        frame[:, :, 2] = ((x[None, :] + y[:, None]) / 2 + i * 8) % 256
+        frame += noise
+        writer.write(frame)
+    writer.release()
+
+
+def build_states(folder):
+    """Create Idle/Talking/Emotes folders with synthetic clips and the matching states."""
+    states = {}
+    for index, (state_name, video_random) in enumerate([("Idle", True), ("Talking", True), ("Emotes", False)]):
+        state_folder = os.path.join(folder, state_name)
+        os.makedirs(state_folder, exist_ok=True)
+        videos = []
+        for clip in range(CLIPS_PER_STATE):
+            path = os.path.join(state_folder, f"{state_name}_{clip}.mp4")
+            generate_clip(path, CLIP_SIZE, CLIP_FRAMES, CLIP_FPS, SEED + index * 100 + clip)
+            videos.append(path)
+        states[state_name] = vt.StateStruct(name=state_name, video_random=video_random, videos=videos)
+
+    states["Idle"].transitions = [("Talking", "MIC", (vt.AUDIO_THRESHOLD_NOISE, vt.NOISE_DURATION, "POSITIVE")),
+                                  ("Emotes", "MIDI", None)]
+    states["Talking"].transitions = [("Idle", "MIC", (vt.AUDIO_THRESHOLD_SILENCE, vt.SILENCE_DURATION, "NEGATIVE")),
+                                     ("Emotes", "MIDI", None)]
+    states["Emotes"].transitions = [("Idle", "Inactivity", None)]
+    return states
+
+
+# ---------------- MEASUREMENT ----------------
+def timings(fn, iterations):
+    """Call fn repeatedly and summarize the per-call time in milliseconds."""
+    samples = np.empty(iterations, dtype=np.float64)
+    for i in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples[i] = time.perf_counter() - start
+    samples *= 1000.0
+    return {
+        "iterations": iterations,
+        "mean_ms": float(samples.mean()),
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p95_ms": float(np.percentile(samples, 95)),
+        "max_ms": float(samples.max()),
+    }
+
+
+def bench_filters(resolutions, iterations):
+    results = {}
+    rng = np.random.default_rng(SEED)
+    for width, height in resolutions:
+        frame = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        filters = vt.Filters(width, height)
+        engine = vt.FilterEngine(width, height)
+
+        def full_chain(fused):
+            vt.FUSED_FILTERS = fused
+            return filters.apply_filters(frame)
+
+        def engine_tiles(tiles):
+            vt.FILTER_TILES = tiles
+            return engine.apply(frame)
+
+        def glitch_chain():
+            vt.FUSED_FILTERS = fused_default
+            filters.start_transition_filter()
+            return filters.apply_filters(frame)
+
+        fused_default = vt.FUSED_FILTERS
+        tiles_default = vt.FILTER_TILES
+        results[f"{width}x{height}"] = {
+            "vhs_wobble": timings(lambda: filters.apply_vhs_wobble(frame), iterations),
+            "chromatic_aberration": timings(lambda: filters.apply_chromatic_aberration(frame), iterations),
+            "scanlines": timings(lambda: filters.apply_scanlines(frame), iterations),
+            "glitch": timings(lambda: filters.generate_glitch_frame(frame), iterations),
+            "filter_engine": timings(lambda: engine_tiles(1), iterations),
+            f"filter_engine_{tiles_default}_tiles": timings(lambda: engine_tiles(tiles_default), iterations),
+            "apply_filters_fused": timings(lambda: full_chain(True), iterations),
+            "apply_filters_separate": timings(lambda: full_chain(False), iterations),
+            "apply_filters_with_glitch": timings(glitch_chain, iterations),
+        }
+        vt.FUSED_FILTERS = fused_default
+        vt.FILTER_TILES = tiles_default
+        engine.release()
+        filters.filter_engine.release()
+    return results
+
+
+def bench_decode(states, frames):
+    """get_frame throughput (decode + resize) for the threaded and the synchronous path."""
+    results = {}
+    threaded_default = vt.DECODE_THREADED
+    for threaded in (True, False):
+        vt.DECODE_THREADED = threaded
+        sm = vt.StateMachine(states)
+        delivered = 0
+        start = time.perf_counter()
+        while delivered < frames:
+            underruns = sm.decode_stats()["underruns"]
+            sm.get_frame()
+            # Underruns hand back the previous frame: yield to the decoder instead of counting it
+            if sm.decode_stats()["underruns"] != underruns:
+                time.sleep(0.0005)
+                continue
+            delivered += 1
+        elapsed = time.perf_counter() - start
+        results["threaded" if threaded else "synchronous"] = {
+            "frames": delivered,
+            "fps": delivered / elapsed,
+            "ms_per_frame": 1000.0 * elapsed / delivered,
+            "decode_stats": sm.decode_stats(),
+        }
+        sm.release()
+    vt.DECODE_THREADED = threaded_default
+    return results
+
+
+def bench_switch(states, iterations):
+    """switch_state plus the first get_frame of the new clip, with and without the clip pool."""
+    results = {}
+    pool_default = vt.CLIP_POOL_ENABLE
+    for pooled in (True, False):
+        vt.CLIP_POOL_ENABLE = pooled
+        sm = vt.StateMachine(states)
+        samples = np.empty(iterations, dtype=np.float64)
+        for i in range(iterations):
+            # Give the pool the time a clip normally plays to pre-warm the next candidates
+            for _ in range(5):
+                sm.get_frame()
+            time.sleep(0.05)
+            start = time.perf_counter()
+            sm.switch_state("Talking" if sm.current_state.name == "Idle" else "Idle")
+            sm.get_frame()
+            samples[i] = time.perf_counter() - start
+        samples *= 1000.0
+        results["pooled" if pooled else "unpooled"] = {
+            "iterations": iterations,
+            "mean_ms": float(samples.mean()),
+            "p50_ms": float(np.percentile(samples, 50)),
+            "p95_ms": float(np.percentile(samples, 95)),
+            "max_ms": float(samples.max()),
+        }
+        sm.release()
+    vt.CLIP_POOL_ENABLE = pool_default
+    return results
+
+
+def bench_end_to_end(states, seconds):
+    """Unpaced update -> get_frame -> apply_filters -> NullSink loop, as fast as it can run."""
+    sm = vt.StateMachine(states)
+    sink = vt.open_output_sink("null", vt.SCREEN_WIDTH, vt.SCREEN_HEIGHT)
+    frames = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        underruns = sm.decode_stats()["underruns"]
+        sm.update()
+        frame = sm.get_frame()
+        frame = sm.apply_filters(frame, out=sink.frame_buffer())
+        if frame is not None:
+            sink.write(frame)
+        # Only count frames that were new, yield to the decoder when it fell behind
+        if sm.decode_stats()["underruns"] != underruns:
+            time.sleep(0.0005)
+            continue
+        frames += 1
+    elapsed = time.perf_counter() - start
+    result = {"frames": frames, "seconds": elapsed, "fps": frames / elapsed,
+              "decode_stats": sm.decode_stats()}
+    sink.close()
+    sm.release()
+    return result
+
+
+# ---------------- MAIN ----------------
+def environment():
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "opencv_threads": cv2.getNumThreads(),
+        "screen": [vt.SCREEN_WIDTH, vt.SCREEN_HEIGHT],
+        "clip": {"size": list(CLIP_SIZE), "frames": CLIP_FRAMES, "fps": CLIP_FPS},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless benchmarks for filters, decode and state switching.")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file the results are written to")
+    parser.add_argument("--quick", action="store_true", help="Fewer iterations, for a fast smoke run")
+    args = parser.parse_args()
+
+    vt.seed_random(SEED)
+    scale = 0.2 if args.quick else 1.0
+    # Keep the run's console output to the benchmark itself
+    vt.SCHEDULER_REPORT_INTERVAL = 0
+    vt.TRACER.enabled = False
+
+    results = {"environment": environment()}
+    with tempfile.TemporaryDirectory(prefix="vt_bench_") as folder:
+        print("Generating synthetic clips...")
+        states = build_states(folder)
+
+        print("Filters...")
+        results["filters"] = bench_filters(RESOLUTIONS, max(5, int(FILTER_ITERATIONS * scale)))
+        print("Decode...")
+        results["decode"] = bench_decode(states, max(30, int(DECODE_FRAMES * scale)))
+        print("State switching...")
+        results["switch_state"] = bench_switch(states, max(5, int(SWITCH_ITERATIONS * scale)))
+        print("End to end...")
+        results["end_to_end"] = bench_end_to_end(states, END_TO_END_SECONDS * scale)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+import video_tuber as vt
+
+# ---------------- CONFIG ----------------
+### Canvas
+WINDOW_NAME = "Camera :3 (compositor)"
+CANVAS_WIDTH = 700
+CANVAS_HEIGHT = 350
+BACKGROUND = (0, 255, 0)          # BGR fill behind and between the avatars (chroma key green)
+CANVAS_FILTERS = True             # Run wobble/CA/color/scanlines once over the canvas instead of once per avatar
+### Avatars
+# name, root (folder holding its Idle/Talking/Emotes folders), mic_device, midi_port (None: no controller)
+# and tile (x, y, width, height) on the canvas; avatars without a tile are laid out in a row
+AVATARS = [
+    {"name": "left", "root": "avatars/left", "mic_device": 1, "midi_port": 5000, "tile": (0, 0, 350, 350)},
+    {"name": "right", "root": "avatars/right", "mic_device": 2, "midi_port": 5001, "tile": (350, 0, 350, 350)},
+]
+SHARE_CLIP_CACHE = True           # Decode each clip once into the clip cache, avatars of the same tile size share it
+
+
+# ---------------- LAYOUT ----------------
+def row_layout(count, width, height):
+    # Equal tiles side by side
+    tile_width = width // count
+    return [(i * tile_width, 0, tile_width, height) for i in range(count)]
+
+
+class Avatar:
+    """One StateMachine, the canvas region it is drawn into and the clock of its clip."""
+    def __init__(self, name, sm, region):
+        self.name = name
+        self.sm = sm
+        self.region = region
+        # Only frames_due() is used: every avatar plays its clip on its own wall clock
+        self.clock = vt.FrameScheduler()
+        self.displayed = False
+
+
+# ---------------- COMPOSITOR ----------------
+class Compositor:
+    """
+    Hosts several StateMachines and lays their frames out on one canvas.
+    Every tick the avatars are stepped in parallel on a thread pool (their clips are
+    decoded by their own decoder threads), each one copies its frame into its own
+    region of the canvas, and the regular filters then run once over the whole canvas.
+    Clips are decoded once into a shared clip cache and played back from the same
+    memory-mapped pages by every avatar that uses them.
+    """
+    def __init__(self, avatars=AVATARS, width=CANVAS_WIDTH, height=CANVAS_HEIGHT):
+        self.width = width
+        self.height = height
+        self.canvas = np.empty((height, width, 3), dtype=np.uint8)
+        self.canvas[:] = BACKGROUND
+        self.filter_engine = vt.FilterEngine(width, height) if CANVAS_FILTERS else None
+
+        # One media index and one clip cache per tile size for everybody
+        self.media_index = vt.MediaIndex()
+        self.clip_caches = {}
+        self.reloaders = []
+        layout = row_layout(len(avatars), width, height)
+        self.avatars = []
+        for config, default_tile in zip(avatars, layout):
+            x, y, w, h = config.get("tile", default_tile)
+            root = config.get("root", os.getcwd())
+            states = vt.copy_states()
+            vt.auto_load_videos_into_states(states, self.media_index, root)
+
+            sm = vt.StateMachine(states, screen_width=w, screen_height=h, name=config["name"],
+                                 mic_device=config.get("mic_device", vt.MIC_DEVICE_INDEX),
+                                 midi_port=config.get("midi_port"), clip_cache=self.clip_cache(w, h))
+            for rule_name, init_fn, callback_fn in vt.RULES:
+                init_fn(sm)
+            if vt.HOT_RELOAD_ENABLE:
+                sm.reloader = vt.StateReloader(states, self.media_index, root)
+                sm.reloader.start()
+            self.avatars.append(Avatar(config["name"], sm, self.canvas[y:y + h, x:x + w]))
+
+        self.pool = ThreadPoolExecutor(max_workers=len(self.avatars), thread_name_prefix="avatar")
+
+    def clip_cache(self, width, height):
+        if not (SHARE_CLIP_CACHE and vt.DECODE_THREADED):
+            return None
+        if (width, height) not in self.clip_caches:
+            self.clip_caches[(width, height)] = vt.ClipCache(width, height)
+        return self.clip_caches[(width, height)]
+
+    def render_avatar(self, avatar):
+        # Runs on a worker: step this avatar and draw it into its region
+        sm = avatar.sm
+        sm.update()
+        frame = sm.get_frame(avatar.clock.frames_due(sm.clip_serial, sm.clip_fps()))
+        if CANVAS_FILTERS:
+            frame = sm.apply_transition_filter(frame)
+        else:
+            frame = sm.apply_filters(frame)
+        avatar.displayed = frame is not None
+        if frame is not None:
+            np.copyto(avatar.region, frame)
+
+    def render(self, out=None):
+        # Returns the finished canvas (written into out when the filters run and out is given)
+        for _ in self.pool.map(self.render_avatar, self.avatars):
+            pass
+        if self.filter_engine is None:
+            return self.canvas
+        return self.filter_engine.apply(self.canvas, out=out)
+
+    def frame_displayed(self):
+        for avatar in self.avatars:
+            if avatar.displayed:
+                avatar.sm.frame_displayed()
+
+    def clip_fps(self):
+        return max((avatar.sm.clip_fps() for avatar in self.avatars), default=0.0)
+
+    def release(self):
+        self.pool.shutdown(wait=True)
+        for avatar in self.avatars:
+            avatar.sm.release()
+        for cache in self.clip_caches.values():
+            cache.release()
+        if self.filter_engine:
+            self.filter_engine.release()
+
+
+# ---------------- MAIN ----------------
+def main():
+    compositor = Compositor()
+    vt.WINDOW_NAME = WINDOW_NAME
+    sink = vt.open_output_sink(vt.OUTPUT_SINK, CANVAS_WIDTH, CANVAS_HEIGHT)
+    scheduler = vt.FrameScheduler()
+
+    try:
+        while True:
+            scheduler.wait(compositor.clip_fps())
+            filter_start = vt.TRACER.now()
+            frame = compositor.render(out=sink.frame_buffer())
+            vt.TRACER.record("compose", filter_start)
+
+            display_start = vt.TRACER.now()
+            sink.write(frame)
+            vt.TRACER.record("display", display_start)
+            compositor.frame_displayed()
+            scheduler.report()
+
+            key = sink.poll_key()
+            if key == vt.TRACE_HOTKEY:
+                vt.TRACER.print_summary()
+                vt.TRACER.dump(vt.TRACE_DUMP_FILE)
+            if key == 27:
+                break
+    except KeyboardInterrupt:
+        print("Exiting...")
+    finally:
+        sink.close()
+        compositor.release()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import threading
+
+# ---------------- CONFIG ----------------
+WATCH_DEBOUNCE = 0.5        # Seconds without new events before a folder's changes are reported
+POLL_INTERVAL = 1.0         # Seconds between scans of the polling backend
+
+# ---------------- INOTIFY ----------------
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+# Finished writes, renames, creations and deletions; plain IN_MODIFY would fire for every chunk of a copy
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+EVENT_HEADER = struct.Struct("iIII")   # wd, mask, cookie, name length
+
+
+class InotifyBackend:
+    """Linux inotify through libc, the thread sleeps in select() until something changes."""
+    def __init__(self):
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # watch descriptor -> folder
+        self.folders = {}
+
+    def add(self, folder):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            print(f"[fs_watch] Cannot watch '{folder}': {os.strerror(error)}")
+            return False
+        self.folders[wd] = folder
+        return True
+
+    def read(self, timeout):
+        # Returns [(folder, name)] of the changes seen within timeout seconds
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+
+        changes = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_IGNORED:
+                # Watched folder was removed
+                self.folders.pop(wd, None)
+                continue
+            folder = self.folders.get(wd)
+            if folder is not None:
+                changes.append((folder, os.fsdecode(name)))
+        return changes
+
+    def close(self):
+        os.close(self.fd)
+
+
+# ---------------- POLLING ----------------
+class PollingBackend:
+    """Fallback for platforms without inotify: compares (size, mtime) snapshots of each folder."""
+    def __init__(self, interval=POLL_INTERVAL):
+        self.interval = interval
+        self.snapshots = {}
+
+    @staticmethod
+    def snapshot(folder):
+        entries = {}
+        try:
+            with os.scandir(folder) as it:
+                for entry in it:
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries[entry.name] = (stat.st_size, stat.st_mtime)
+        except OSError:
+            pass
+        return entries
+
+    def add(self, folder):
+        self.snapshots[folder] = self.snapshot(folder)
+        return True
+
+    def read(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        changes = []
+        for folder, old in self.snapshots.items():
+            new = self.snapshot(folder)
+            if new != old:
+                names = {name for name in old.keys() | new.keys() if old.get(name) != new.get(name)}
+                changes.extend((folder, name) for name in names)
+                self.snapshots[folder] = new
+        return changes
+
+    def close(self):
+        pass
+
+
+def create_backend():
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyBackend()
+        except (OSError, AttributeError) as e:
+            print(f"[fs_watch] inotify unavailable ({e}), polling instead")
+    return PollingBackend()
+
+
+# ---------------- WATCHER ----------------
+class FolderWatcher(threading.Thread):
+    """
+    Watches a set of folders on a background thread and calls callback(folder, names)
+    once a folder has been quiet for `debounce` seconds, with every name that changed
+    in it. The callback runs on the watcher thread.
+    """
+    def __init__(self, folders, callback, debounce=WATCH_DEBOUNCE, backend=None):
+        super().__init__(daemon=True)
+        self.callback = callback
+        self.debounce = debounce
+        self.backend = backend if backend is not None else create_backend()
+        self.stopped = threading.Event()
+        # folder -> (names, time of the last event)
+        self.pending = {}
+        for folder in folders:
+            self.add(folder)
+
+    def add(self, folder):
+        return self.backend.add(folder)
+
+    def run(self):
+        while not self.stopped.is_set():
+            timeout = self.debounce if self.pending else 0.5
+            for folder, name in self.backend.read(timeout):
+                names, _ = self.pending.get(folder, (set(), 0.0))
+                names.add(name)
+                self.pending[folder] = (names, time.monotonic())
+
+            now = time.monotonic()
+            for folder, (names, last) in list(self.pending.items()):
+                if now - last >= self.debounce:
+                    del self.pending[folder]
+                    try:
+                        self.callback(folder, names)
+                    except Exception as e:
+                        print(f"[fs_watch] Reload of '{folder}' failed: {e}")
+        self.backend.close()
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,113 @@
+import os
+import struct
+import time
+from collections import namedtuple
+
+# ---------------- MESSAGES ----------------
+# One button press forwarded by midi_reader to the video process
+TriggerMessage = namedtuple("TriggerMessage", ["tag", "btn_type", "timestamp"])
+
+# Button types from the MIDI CSV, the binary encoding sends the index.
+# "Release" is not a CSV type: it is sent when a Press button is let go.
+BUTTON_TYPES = ["Press", "Toggle", "Release"]
+# Feedback the video process pushes back over the same connection for the controller LEDs:
+# the emote of tag is "Playing", "Latched" (playing, held by its Toggle) or has "Stopped"
+FEEDBACK_TYPES = ["Playing", "Latched", "Stopped"]
+# Type codes of the binary encoding
+MESSAGE_TYPES = BUTTON_TYPES + FEEDBACK_TYPES
+
+# ---------------- TAGS ----------------
+# Tags name clips, both processes compare them in this form
+VIDEO_EXT = (".mp4", ".mov", ".avi", ".mkv")
+
+def normalize_tag(name):
+    # 'Emotes/Wave.MOV', 'wave.mp4' and ' Wave ' all become 'wave'
+    base = os.path.basename(name).strip().lower()
+    stem, ext = os.path.splitext(base)
+    return stem if ext in VIDEO_EXT else base
+
+
+# ---------------- FRAMING ----------------
+### Text: one "tag,type[,timestamp]" message per line
+LINE_END = b"\n"
+MAX_LINE_LENGTH = 1024        # Longer unterminated data is dropped as garbage
+### Binary: marker byte, header (type code, tag length, timestamp), then the utf-8 tag
+BINARY_MARKER = 0x00          # Text lines never start with a NUL byte
+BINARY_HEADER = struct.Struct("!BBd")
+
+
+def encode_text(tag, btn_type, timestamp=None):
+    """Encode a trigger as a newline-terminated 'tag,type,timestamp' line."""
+    if timestamp is None:
+        timestamp = time.time()
+    return f"{tag},{btn_type},{timestamp:.6f}\n".encode("utf-8")
+
+
+def encode_binary(tag, btn_type, timestamp=None):
+    """Encode a trigger in the compact binary framing (tags up to 255 bytes)."""
+    if timestamp is None:
+        timestamp = time.time()
+    tag_bytes = tag.encode("utf-8")[:255]
+    type_code = MESSAGE_TYPES.index(btn_type) if btn_type in MESSAGE_TYPES else 0
+    return bytes([BINARY_MARKER]) + BINARY_HEADER.pack(type_code, len(tag_bytes), timestamp) + tag_bytes
+
+
+def parse_line(line):
+    """Parse one text line, returns a TriggerMessage or None for an empty line."""
+    parts = [part.strip() for part in line.decode("utf-8", errors="replace").split(",")]
+    if not parts[0]:
+        return None
+    btn_type = parts[1] if len(parts) > 1 and parts[1] else BUTTON_TYPES[0]
+    try:
+        timestamp = float(parts[2]) if len(parts) > 2 else time.time()
+    except ValueError:
+        timestamp = time.time()
+    return TriggerMessage(parts[0], btn_type, timestamp)
+
+
+class MessageDecoder:
+    """
+    Incremental decoder for one connection. feed() takes whatever recv() returned and
+    gives back every complete message in it, so presses merged into one chunk or split
+    across chunks are framed correctly. Text and binary frames can be mixed.
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer += data
+        messages = []
+        while self.buffer:
+            if self.buffer[0] == BINARY_MARKER:
+                header_end = 1 + BINARY_HEADER.size
+                if len(self.buffer) < header_end:
+                    break
+                type_code, tag_length, timestamp = BINARY_HEADER.unpack_from(self.buffer, 1)
+                if len(self.buffer) < header_end + tag_length:
+                    break
+                tag = self.buffer[header_end:header_end + tag_length].decode("utf-8", errors="replace")
+                del self.buffer[:header_end + tag_length]
+                btn_type = MESSAGE_TYPES[type_code] if type_code < len(MESSAGE_TYPES) else BUTTON_TYPES[0]
+                messages.append(TriggerMessage(tag, btn_type, timestamp))
+                continue
+
+            line_end = self.buffer.find(LINE_END)
+            if line_end < 0:
+                if len(self.buffer) > MAX_LINE_LENGTH:
+                    self.buffer.clear()
+                break
+            message = parse_line(bytes(self.buffer[:line_end]))
+            del self.buffer[:line_end + 1]
+            if message is not None:
+                messages.append(message)
+        return messages
+
+    def flush(self):
+        """Return the unterminated text left when the connection closes, if any."""
+        messages = []
+        if self.buffer and self.buffer[0] != BINARY_MARKER:
+            message = parse_line(bytes(self.buffer))
+            if message is not None:
+                messages.append(message)
+        self.buffer.clear()
+        return messages
@@ -1,14 +1,32 @@
 import os
 import csv
 import socket
+import select
+import threading
 import mido
 import time
+import queue
+from collections import deque
+from midi_protocol import encode_text, encode_binary, MessageDecoder, normalize_tag
+from fs_watch import FolderWatcher
 
 # ---------------- CONFIG ----------------
 SERVER_HOST = '127.0.0.1'
 SERVER_PORT = 5000
+USE_BINARY_PROTOCOL = False   # Send compact binary frames instead of text lines
+RECONNECT_DELAY_MIN = 0.1     # Seconds before the first reconnect attempt, doubled after every failure
+RECONNECT_DELAY_MAX = 5.0     # Cap of the reconnect backoff
+SEND_BUFFER_SIZE = 256        # Presses kept while the server is unreachable, the oldest are dropped beyond this
+
+### LEDs (velocities pick the pad colour, values depend on the controller)
+LED_ON = 127                  # Configured pad
+LED_PLAYING = 60              # Pad of the emote playing now
+LED_LATCHED = 15              # Pad of a Toggle emote that is latched on
+LED_RATE = 2000               # LED messages per second the controller is sent at most
+LED_BURST = 64                # Messages that may go out back to back before the rate applies
 
 MIDI_CONFIG_FOLDER = "midi_configs"
+HOT_RELOAD = True             # Reload the button mappings when the selected CSV changes on disk
 
 # ---------------- FUNCTIONS ----------------
 def select_midi_config():
@@ -63,8 +81,9 @@ def load_midi_config(csv_file):
     return device_name, buttons
 
 
-def open_midi_device(device_name_csv):
-    """Open the MIDI input and output device. Allows different input/output indexes if needed."""
+def open_midi_device(device_name_csv, callback=None):
+    """Open the MIDI input and output device. Allows different input/output indexes if needed.
+    With a callback, incoming messages are handed to it on the MIDI backend's thread."""
     available_inputs = mido.get_input_names()
     available_outputs = mido.get_output_names()
     
@@ -97,7 +116,7 @@ def open_midi_device(device_name_csv):
             return None, None
 
     try:
-        inport = mido.open_input(in_name)
+        inport = mido.open_input(in_name, callback=callback)
         outport = mido.open_output(out_name)
         return inport, outport
     except IOError as e:
@@ -105,29 +124,346 @@ def open_midi_device(device_name_csv):
         return None, None
 
 
-def turn_on_leds(outport, buttons):
-    """Turn on green LEDs for all configured buttons (velocity=127)."""
-    for note in buttons:
-        msg = mido.Message('note_on', note=note, velocity=127)
-        outport.send(msg)
-        time.sleep(0.01)
-    print(f"Turned on LEDs for {len(buttons)} configured buttons.")
+def watch_midi_config(csv_file):
+    """
+    Watch the selected CSV and queue its new button mappings whenever it changes.
+    The file is parsed on the watcher thread, the main loop only swaps the dict.
+    """
+    reloads = queue.SimpleQueue()
+    folder = os.path.abspath(os.path.dirname(csv_file))
+    name = os.path.basename(csv_file)
+
+    def config_changed(changed_folder, names):
+        if name not in names:
+            return
+        try:
+            device_name, buttons = load_midi_config(csv_file)
+        except (OSError, ValueError, IndexError) as e:
+            print(f"Could not reload '{csv_file}': {e}")
+            return
+        if device_name:
+            reloads.put(buttons)
+
+    watcher = FolderWatcher([folder], config_changed)
+    watcher.start()
+    return watcher, reloads
+
+
+# ---------------- LEDS ----------------
+class TokenBucket:
+    """Lets `rate` messages per second through, with bursts of up to `burst`."""
+    def __init__(self, rate=LED_RATE, burst=LED_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last = time.monotonic()
+
+    def take(self):
+        # Blocks until a message may be sent
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < 1.0:
+            time.sleep((1.0 - self.tokens) / self.rate)
+            self.last = time.monotonic()
+            self.tokens = 1.0
+        self.tokens -= 1.0
+
+
+class LedBoard(threading.Thread):
+    """
+    What every pad of the controller should show and what it was last sent.
+    show() only replaces the wanted state; the LED thread sends the pads that differ,
+    paced by a token bucket, so a pad changed several times in a row only sends its
+    latest value. Pads are unknown at startup and are each sent once.
+    """
+    def __init__(self, outport, bucket=None):
+        super().__init__(daemon=True)
+        self.outport = outport
+        self.bucket = bucket if bucket is not None else TokenBucket()
+        self.wanted = [0] * 128
+        self.shown = [None] * 128
+        self.cond = threading.Condition()
+        self.dirty = True
+        self.stopped = False
+
+    def show(self, velocities):
+        # velocities: note -> velocity, every other pad goes dark
+        wanted = [0] * 128
+        for note, velocity in velocities.items():
+            wanted[note] = velocity
+        with self.cond:
+            self.wanted = wanted
+            self.dirty = True
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.dirty or self.stopped)
+                if self.stopped:
+                    break
+                self.dirty = False
+                wanted = self.wanted
+            for note, velocity in enumerate(wanted):
+                if self.shown[note] == velocity:
+                    continue
+                self.bucket.take()
+                self.outport.send(mido.Message('note_on', note=note, velocity=velocity))
+                self.shown[note] = velocity
+                # A newer state replaces the rest of this pass
+                if self.dirty:
+                    break
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+
+
+class PadFeedback:
+    """
+    Lights the configured pads and, from the feedback the video process pushes back,
+    the pad of the emote playing (LED_PLAYING) or latched by its Toggle (LED_LATCHED).
+    on_message/on_connect run on the link thread, set_buttons on the main thread.
+    """
+    def __init__(self, leds, buttons):
+        self.leds = leds
+        self.buttons = buttons
+        self.lock = threading.Lock()
+        # (tag of the emote playing or None, latched)
+        self.playing = (None, False)
+        self.refresh()
+
+    def refresh(self):
+        with self.lock:
+            self.show()
+
+    def show(self):
+        # Called with the lock held
+        tag, latched = self.playing
+        velocities = {}
+        for note, button in self.buttons.items():
+            if tag is not None and normalize_tag(button['tag']) == tag:
+                velocities[note] = LED_LATCHED if latched else LED_PLAYING
+            else:
+                velocities[note] = LED_ON
+        self.leds.show(velocities)
+
+    def set_buttons(self, buttons):
+        with self.lock:
+            self.buttons = buttons
+            self.show()
+
+    def on_connect(self):
+        # A new connection (server restart) knows nothing we showed, it resends what plays
+        with self.lock:
+            self.playing = (None, False)
+            self.show()
+
+    def on_message(self, message):
+        tag = normalize_tag(message.tag)
+        with self.lock:
+            if message.btn_type == "Playing":
+                self.playing = (tag, False)
+            elif message.btn_type == "Latched":
+                self.playing = (tag, True)
+            elif message.btn_type == "Stopped" and self.playing[0] == tag:
+                self.playing = (None, False)
+            else:
+                return
+            self.show()
+
+
+def apply_config_reload(feedback, new_buttons):
+    """Light the pads of the new mappings, removed pads go dark."""
+    feedback.set_buttons(new_buttons)
+    print(f"Reloaded MIDI config: {len(new_buttons)} buttons")
+
+
+# ---------------- SERVER LINK ----------------
+class ServerLink(threading.Thread):
+    """
+    Persistent connection to the video process. send() only queues an encoded message
+    and wakes the link thread, which writes everything queued so far with one sendall(),
+    so presses that arrive together leave in one segment. The same thread reads the LED
+    feedback the server pushes back and hands it to on_message. While the server is
+    unreachable messages wait in a bounded buffer (oldest dropped first) and the link
+    reconnects with backoff.
+    """
+    def __init__(self, host=SERVER_HOST, port=SERVER_PORT, capacity=SEND_BUFFER_SIZE,
+                 on_message=None, on_connect=None):
+        super().__init__(daemon=True)
+        self.address = (host, port)
+        self.pending = deque(maxlen=capacity)
+        self.lock = threading.Lock()
+        self.on_message = on_message
+        self.on_connect = on_connect
+        # send() and stop() write a byte here to interrupt select()
+        self.wake_reader, self.wake_writer = socket.socketpair()
+        self.wake_reader.setblocking(False)
+        self.wake_writer.setblocking(False)
+        self.sock = None
+        self.decoder = None
+        self.stopped = False
+        self.dropped = 0
+
+    def send(self, data):
+        # Safe to call from any thread, never blocks on the network
+        with self.lock:
+            if len(self.pending) == self.pending.maxlen:
+                self.count_dropped(1)
+            self.pending.append(data)
+        self.wake()
+
+    def wake(self):
+        try:
+            self.wake_writer.send(b"\0")
+        except OSError:
+            # Full: a wake up is already pending
+            pass
+
+    def wait(self, timeout):
+        # Sleep until send(), stop(), data from the server or the timeout; returns the readable sockets
+        sockets = [self.wake_reader] if self.sock is None else [self.wake_reader, self.sock]
+        readable, _, _ = select.select(sockets, [], [], timeout)
+        if self.wake_reader in readable:
+            try:
+                self.wake_reader.recv(4096)
+            except OSError:
+                pass
+        return readable
+
+    def count_dropped(self, count):
+        self.dropped += count
+        print(f"[ServerLink] Buffer full, dropped {count} press(es) ({self.dropped} so far)")
+
+    def requeue(self, batch):
+        # Put an unsent batch back in front of anything queued since, keeping the newest messages
+        with self.lock:
+            messages = batch + list(self.pending)
+            overflow = len(messages) - self.pending.maxlen
+            if overflow > 0:
+                self.count_dropped(overflow)
+            self.pending.clear()
+            self.pending.extend(messages)
+
+    def connect(self):
+        # Blocks until connected (returns the socket) or stopped (returns None)
+        delay = RECONNECT_DELAY_MIN
+        host, port = self.address
+        while not self.stopped:
+            try:
+                sock = socket.create_connection(self.address, timeout=RECONNECT_DELAY_MAX)
+            except OSError as e:
+                print(f"[ServerLink] Cannot reach {host}:{port} ({e}), retrying in {delay:.1f}s")
+                # Presses arriving meanwhile are only queued, they do not cut the backoff short
+                retry_at = time.monotonic() + delay
+                while not self.stopped and time.monotonic() < retry_at:
+                    self.wait(retry_at - time.monotonic())
+                delay = min(delay * 2, RECONNECT_DELAY_MAX)
+                continue
+            # Presses are tiny and latency bound: no Nagle coalescing
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.settimeout(None)
+            self.decoder = MessageDecoder()
+            print(f"Connected to server at {host}:{port}")
+            if self.on_connect:
+                self.on_connect()
+            return sock
+        return None
+
+    def receive(self):
+        # Feedback pushed by the server, False once the server closed the connection
+        try:
+            data = self.sock.recv(4096)
+        except OSError:
+            return False
+        if not data:
+            return False
+        for message in self.decoder.feed(data):
+            if self.on_message:
+                self.on_message(message)
+        return True
+
+    def disconnect(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def run(self):
+        while not self.stopped:
+            if self.sock is None:
+                self.sock = self.connect()
+                continue
+            with self.lock:
+                queued = bool(self.pending)
+            # Sleeps in select() until there is something to send or to read
+            readable = self.wait(0 if queued else None)
+            if self.stopped:
+                break
+            if self.sock in readable and not self.receive():
+                print("[ServerLink] Server closed the connection, reconnecting")
+                self.disconnect()
+                continue
+            with self.lock:
+                batch = list(self.pending)
+                self.pending.clear()
+            if not batch:
+                continue
+            try:
+                self.sock.sendall(b"".join(batch))
+            except OSError as e:
+                print(f"[ServerLink] Send failed ({e}), reconnecting")
+                self.requeue(batch)
+                self.disconnect()
+        self.disconnect()
+
+    def stop(self):
+        self.stopped = True
+        self.wake()
+
+
+class ButtonForwarder:
+    """
+    mido input callback: forwards configured buttons to the server the moment the
+    MIDI backend delivers them. Runs on the backend's thread, `buttons` is swapped
+    whole by the main thread when the config is reloaded.
+    """
+    def __init__(self, buttons, link):
+        self.buttons = buttons
+        self.link = link
+        self.encode = encode_binary if USE_BINARY_PROTOCOL else encode_text
+        self.pressed_notes = set()  # simple debounce for current session
+
+    def __call__(self, msg):
+        buttons = self.buttons
+        if msg.type == 'note_on' and msg.velocity > 0:
+            note = msg.note
+            if note in buttons and note not in self.pressed_notes:
+                tag = buttons[note]['tag']
+                btn_type = buttons[note]['type']
+
+                # Send to server, stamped with the time of the press
+                self.link.send(self.encode(tag, btn_type))
+
+                # Mark as pressed for this session
+                self.pressed_notes.add(note)
+
+                # Print info locally
+                print(f"Button pressed: Tag='{tag}', Type='{btn_type}'")
+        elif msg.type == 'note_off' or (msg.type == 'note_on' and msg.velocity == 0):
+            # Remove from pressed_notes so next press can be detected
+            note = msg.note
+            if note in self.pressed_notes:
+                self.pressed_notes.remove(note)
+                # Press buttons hold their emote, tell the server when they are let go
+                if note in buttons and buttons[note]['type'] == 'Press':
+                    self.link.send(self.encode(buttons[note]['tag'], 'Release'))
 
-def turn_off_all_leds(outport):
-    """Turn off all LEDs on the MIDI device (velocity=0)."""
-    for note in range(128):  # MIDI notes range from 0 to 127
-        msg = mido.Message('note_on', note=note, velocity=0)
-        outport.send(msg)
-        time.sleep(0.005)  # small delay to ensure MIDI device receives messages
-    print("All LEDs turned off.")
 
 # ---------------- MAIN ----------------
 def main():
-    # Connect to server
-    client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    client.connect((SERVER_HOST, SERVER_PORT))
-    print(f"Connected to server at {SERVER_HOST}:{SERVER_PORT}")
-
     # Select MIDI config
     csv_file = select_midi_config()
     if not csv_file:
@@ -139,52 +475,52 @@ def main():
         print("No device specified in CSV. Exiting.")
         return
 
-    # Open MIDI device using Option 2 logic
-    inport, outport = open_midi_device(device_name_csv)
+    # Open MIDI device using Option 2 logic, presses are forwarded from the input callback
+    link = ServerLink()
+    forwarder = ButtonForwarder(buttons, link)
+    inport, outport = open_midi_device(device_name_csv, forwarder)
     if not inport:
         return
 
-    # Reset board first
-    turn_off_all_leds(outport)
+    # Light the configured pads (every other pad is cleared once), then follow the server's feedback
+    leds = LedBoard(outport)
+    feedback = PadFeedback(leds, buttons)
+    link.on_message = feedback.on_message
+    link.on_connect = feedback.on_connect
+    leds.start()
 
-    # Turn on LEDs for configured buttons
-    turn_on_leds(outport, buttons) 
+    # Connect to server in the background, presses are buffered until it is reachable
+    link.start()
 
-    print("Listening for button presses... Press Ctrl+C to exit.")
+    # Pick up edits of the CSV without restarting
+    watcher, reloads = watch_midi_config(csv_file) if HOT_RELOAD else (None, None)
 
-    pressed_notes = set()  # simple debounce for current session
+    print("Listening for button presses... Press Ctrl+C to exit.")
 
     try:
         while True:
-            for msg in inport.iter_pending():
-                if msg.type == 'note_on' and msg.velocity > 0:
-                    note = msg.note
-                    if note in buttons and note not in pressed_notes:
-                        tag = buttons[note]['tag']
-                        btn_type = buttons[note]['type']
-
-                        # Print info locally
-                        print(f"Button pressed: Tag='{tag}', Type='{btn_type}'")
-
-                        # Send to server
-                        message = f"{tag},{btn_type}"
-                        client.sendall(message.encode('utf-8'))
-
-                        # Mark as pressed for this session
-                        pressed_notes.add(note)
-                elif msg.type == 'note_off' or (msg.type == 'note_on' and msg.velocity == 0):
-                    # Remove from pressed_notes so next press can be detected
-                    note = msg.note
-                    if note in pressed_notes:
-                        pressed_notes.remove(note)
-
-            time.sleep(0.01)
+            # Presses never pass through here, this thread only swaps in reloaded mappings
+            if reloads is None:
+                time.sleep(0.5)
+                continue
+            try:
+                new_buttons = reloads.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            forwarder.buttons = new_buttons
+            apply_config_reload(feedback, new_buttons)
 
     except KeyboardInterrupt:
         print("Exiting...")
-        client.close()
-        outport.close()
+    finally:
+        if watcher:
+            watcher.stop()
         inport.close()
+        link.stop()
+        link.join(timeout=1.0)
+        leds.stop()
+        leds.join(timeout=1.0)
+        outport.close()
 
 
 if __name__ == "__main__":
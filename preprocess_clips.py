@@ -0,0 +1,195 @@
+import os
+import sys
+import json
+import shutil
+import argparse
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import cv2
+
+import video_tuber as vt
+
+# ---------------- CONFIG ----------------
+FFMPEG = "ffmpeg"
+X264_PRESET = "medium"
+
+
+# ---------------- ENCODING ----------------
+def encode_settings(width, height, fps, gop, crf):
+    """Everything that changes the output, a manifest made with other settings is redone."""
+    return {"width": width, "height": height, "fps": fps, "gop": gop, "crf": crf, "preset": X264_PRESET}
+
+
+def ffmpeg_command(source, output, settings):
+    # Scale to the output size up front, constant frame rate, fixed short GOP without
+    # B-frames so every frame decodes from the last keyframe forward only
+    gop = settings["gop"]
+    return [
+        FFMPEG, "-hide_banner", "-loglevel", "error", "-y", "-i", source,
+        "-an",
+        "-vf", f"scale={settings['width']}:{settings['height']}:flags=area,fps={settings['fps']}",
+        "-c:v", "libx264", "-preset", settings["preset"], "-crf", str(settings["crf"]),
+        "-tune", "fastdecode", "-pix_fmt", "yuv420p",
+        "-g", str(gop), "-keyint_min", str(gop), "-sc_threshold", "0", "-bf", "0",
+        "-threads", "1",
+        "-movflags", "+faststart",
+        output,
+    ]
+
+
+def probe(path):
+    # Frame count and fps of a normalized clip, counted once here so the runtime never asks
+    cap = cv2.VideoCapture(path)
+    frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+    return frames, fps
+
+
+def normalize_clip(source, output, settings):
+    """Runs in a worker process. Returns the manifest entry of the normalized clip."""
+    tmp = output + ".tmp.mp4"
+    result = subprocess.run(ffmpeg_command(source, tmp, settings), capture_output=True, text=True)
+    if result.returncode != 0:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise RuntimeError(result.stderr.strip() or f"ffmpeg exited with {result.returncode}")
+    os.replace(tmp, output)
+
+    frames, fps = probe(output)
+    stat = os.stat(source)
+    return {
+        "output": os.path.basename(output),
+        "source_size": stat.st_size,
+        "source_mtime": stat.st_mtime,
+        "frames": frames,
+        "fps": fps,
+        "duration": frames / fps if fps else 0.0,
+    }
+
+
+# ---------------- MANIFEST ----------------
+def load_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(path, manifest):
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def output_names(sources):
+    """
+    Source name -> normalized clip name. Sources sharing a stem ('Wave.mov', 'Wave.mp4') would
+    write the same file: the first keeps the stem, the others keep their extension in the name.
+    """
+    names = {}
+    taken = set()
+    for name in sources:
+        stem = os.path.splitext(name)[0]
+        if stem.lower() in taken:
+            print(f"Warning: '{name}' has the same name as another clip, normalized as '{name}.mp4'")
+            names[name] = name + ".mp4"
+        else:
+            names[name] = stem + ".mp4"
+        taken.add(stem.lower())
+    return names
+
+
+def is_current(entry, source, output_folder, output_name):
+    # Unchanged source and its normalized clip is still there under the expected name
+    if not entry or entry["output"] != output_name or not os.path.isfile(os.path.join(output_folder, output_name)):
+        return False
+    stat = os.stat(source)
+    return entry["source_size"] == stat.st_size and entry["source_mtime"] == stat.st_mtime
+
+
+# ---------------- MAIN ----------------
+def plan_state(folder, settings, force):
+    """Returns (output folder, manifest, [(source name, source path, output path)] to encode)."""
+    output_folder = os.path.join(folder, vt.PREPROCESS_FOLDER)
+    manifest = load_manifest(os.path.join(output_folder, vt.PREPROCESS_MANIFEST))
+    clips = manifest.get("clips", {})
+    if force or manifest.get("settings") != settings:
+        clips = {}
+
+    sources = sorted(f for f in os.listdir(folder) if f.lower().endswith(vt.VIDEO_EXT))
+    outputs = output_names(sources)
+    # Forget clips whose source is gone, and normalized clips no source writes anymore
+    for name in list(clips):
+        if name not in sources:
+            stale = os.path.join(output_folder, clips.pop(name)["output"])
+        else:
+            stale = os.path.join(output_folder, clips[name]["output"])
+        if os.path.basename(stale) not in outputs.values() and os.path.exists(stale):
+            os.remove(stale)
+
+    jobs = []
+    for name in sources:
+        source = os.path.join(folder, name)
+        if not is_current(clips.get(name), source, output_folder, outputs[name]):
+            # Re-added once encoded, a failed encode must not leave an entry pointing at another clip
+            clips.pop(name, None)
+            jobs.append((name, source, os.path.join(output_folder, outputs[name])))
+    return output_folder, {"settings": settings, "clips": clips}, jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Normalize the clips of every state folder for fast decoding.")
+    parser.add_argument("states", nargs="*", help="State folders to process (default: every state in STATES)")
+    parser.add_argument("--root", default=os.getcwd(), help="Folder holding the state folders")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Clips encoded in parallel")
+    parser.add_argument("--fps", type=float, default=vt.OUTPUT_FPS or 30, help="Output frame rate")
+    parser.add_argument("--gop", type=int, default=vt.PREPROCESS_GOP, help="Keyframe interval in frames")
+    parser.add_argument("--crf", type=int, default=vt.PREPROCESS_CRF, help="x264 quality")
+    parser.add_argument("--force", action="store_true", help="Re-encode every clip")
+    args = parser.parse_args()
+
+    if shutil.which(FFMPEG) is None:
+        print(f"'{FFMPEG}' was not found on PATH")
+        sys.exit(1)
+
+    settings = encode_settings(vt.SCREEN_WIDTH, vt.SCREEN_HEIGHT, args.fps, args.gop, args.crf)
+    states = {}
+    for state_name in args.states or list(vt.STATES):
+        folder = os.path.join(args.root, state_name)
+        if not os.path.isdir(folder):
+            print(f"Warning: folder '{folder}' does not exist.")
+            continue
+        states[state_name] = plan_state(folder, settings, args.force)
+
+    total = sum(len(jobs) for _, _, jobs in states.values())
+    print(f"{total} clip(s) to normalize with {args.jobs} worker(s)")
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = {}
+        for state_name, (output_folder, manifest, jobs) in states.items():
+            os.makedirs(output_folder, exist_ok=True)
+            for name, source, output in jobs:
+                futures[pool.submit(normalize_clip, source, output, settings)] = (state_name, name)
+
+        for future in as_completed(futures):
+            state_name, name = futures[future]
+            try:
+                entry = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"[{state_name}] FAILED {name}: {e}")
+                continue
+            states[state_name][1]["clips"][name] = entry
+            print(f"[{state_name}] {name}: {entry['frames']} frames @ {entry['fps']:.2f} fps")
+
+    # Manifests last, so an interrupted run simply redoes the missing clips
+    for output_folder, manifest, _ in states.values():
+        os.makedirs(output_folder, exist_ok=True)
+        save_manifest(os.path.join(output_folder, vt.PREPROCESS_MANIFEST), manifest)
+    print(f"Done, {total - failed} normalized, {failed} failed")
+
+
+if __name__ == "__main__":
+    main()
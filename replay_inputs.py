@@ -0,0 +1,152 @@
+import time
+import heapq
+import argparse
+from collections import Counter
+
+import video_tuber as vt
+
+# ---------------- CONFIG ----------------
+DEFAULT_SEED = 0                 # Seed of vt.RNG for the replayed session
+DEFAULT_SINK = "null"            # Frames go nowhere unless another sink is asked for
+
+
+# ---------------- REPLAY ----------------
+class ReplayClock:
+    """Virtual time of an as-fast-as-possible replay, seconds since the recording started."""
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self):
+        return self.time
+
+
+class InputReplay:
+    """
+    Feeds a recording made with INPUT_RECORD_FILE back into a StateMachine the way the
+    live sources do: MIC blocks go into its level meter (which keeps its own sample
+    clock) and triggers through its request scheduler. deliver(now) hands over every
+    record up to `now`, seconds on the recording's time base.
+    """
+    def __init__(self, sm, path):
+        self.sm = sm
+        self.records = vt.InputRecorder.read(path)
+        self.next_record = next(self.records, None)
+        # Times the MIDI rule has to look again, when a coalescing window closes
+        self.timers = []
+        self.counts = Counter()
+        sm.mic_meter = vt.create_mic_meter(sm)
+
+    def finished(self):
+        return self.next_record is None and not self.timers
+
+    def deliver(self, now):
+        while self.next_record is not None and self.next_record[0] <= now:
+            t, record_type, payload = self.next_record
+            if record_type == vt.InputRecorder.STREAM:
+                self.sm.mic_meter.set_stream(*payload)
+                self.counts["stream"] += 1
+            elif record_type == vt.InputRecorder.MIC_BLOCK:
+                self.sm.mic_meter.add_block(*payload)
+                self.counts["mic_blocks"] += 1
+            elif record_type == vt.InputRecorder.TRIGGER:
+                delay = self.sm.requests.submit(payload, t)
+                if delay is not None:
+                    heapq.heappush(self.timers, t + delay)
+                self.counts["triggers"] += 1
+            self.next_record = next(self.records, None)
+
+        while self.timers and self.timers[0] <= now:
+            heapq.heappop(self.timers)
+            self.sm.post_event("MIDI")
+
+
+def replay(path, fast, sink_name, threaded, until=None):
+    """Run the recording through a headless state machine, returns the run's stats."""
+    if fast and not threaded:
+        # Decode inline so every tick gets exactly the frame it asks for: same inputs, same session
+        vt.DECODE_THREADED = False
+    vt.auto_load_videos_into_states(vt.STATES)
+    sm = vt.StateMachine(vt.STATES, midi_port=None)
+    # The replay stands in for the microphone, the other rules start as usual (no MIDI port: no server)
+    for rule_name, init_fn, callback_fn in vt.RULES:
+        if rule_name != "MIC":
+            init_fn(sm)
+    source = InputReplay(sm, path)
+    sink = vt.open_output_sink(sink_name, vt.SCREEN_WIDTH, vt.SCREEN_HEIGHT)
+
+    if fast:
+        clock = ReplayClock()
+        scheduler = vt.FrameScheduler(clock=clock)
+    else:
+        replay_start = vt.TRACER.now()
+        clock = lambda: vt.TRACER.now() - replay_start
+        scheduler = vt.FrameScheduler()
+    sm.requests.clock = clock
+
+    ticks = 0
+    wall_start = time.perf_counter()
+    try:
+        while not source.finished() and (until is None or clock() < until):
+            if fast:
+                if ticks:
+                    clock.time += 1.0 / (scheduler.fps or sm.clip_fps() or 30.0)
+            else:
+                scheduler.wait(sm.clip_fps())
+            source.deliver(clock())
+            sm.update()
+            frame = sm.get_frame(scheduler.frames_due(sm.clip_serial, sm.clip_fps()))
+            filter_start = vt.TRACER.now()
+            frame = sm.apply_filters(frame, out=sink.frame_buffer())
+            vt.TRACER.record("filter_chain", filter_start)
+            if frame is not None:
+                display_start = vt.TRACER.now()
+                sink.write(frame)
+                vt.TRACER.record("display", display_start)
+                sm.frame_displayed()
+            ticks += 1
+            if not fast:
+                scheduler.report()
+            if sink.poll_key() == 27:
+                break
+    except KeyboardInterrupt:
+        print("Exiting...")
+    finally:
+        sink.close()
+        sm.release()
+
+    wall = time.perf_counter() - wall_start
+    return {
+        "replayed_seconds": clock(),
+        "wall_seconds": wall,
+        "speed": clock() / wall if wall else 0.0,
+        "ticks": ticks,
+        "inputs": dict(source.counts),
+        "requests": dict(sm.requests.stats),
+        "final_state": sm.current_state.name,
+        "decode_stats": sm.decode_stats(),
+    }
+
+
+# ---------------- MAIN ----------------
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded MIC and MIDI inputs through a headless state machine.")
+    parser.add_argument("recording", help="File written with INPUT_RECORD_FILE")
+    parser.add_argument("--fast", action="store_true", help="Run as fast as possible on a virtual clock instead of real time")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="Seed of the clip and glitch choices")
+    parser.add_argument("--sink", default=DEFAULT_SINK, choices=sorted(vt.OUTPUT_SINKS), help="Where frames go")
+    parser.add_argument("--threaded", action="store_true",
+                        help="Keep background decoding with --fast (closer to live, but not frame exact)")
+    parser.add_argument("--until", type=float, default=None, help="Stop after this many recorded seconds")
+    args = parser.parse_args()
+
+    vt.seed_random(args.seed)
+    stats = replay(args.recording, args.fast, args.sink, args.threaded, args.until)
+
+    print(f"Replayed {stats['replayed_seconds']:.1f}s in {stats['wall_seconds']:.1f}s "
+          f"({stats['speed']:.1f}x), {stats['ticks']} frames, final state {stats['final_state']}")
+    print(f"Inputs: {stats['inputs']}  Requests: {stats['requests']}")
+    vt.TRACER.print_summary()
+
+
+if __name__ == "__main__":
+    main()
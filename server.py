@@ -1,35 +1,35 @@
-import socket
-import threading
+import asyncio
+from midi_protocol import MessageDecoder
 
 # ---------------- CONFIG ----------------
 HOST = '0.0.0.0'  # Listen on all network interfaces
 PORT = 5000       # Port to listen on
 
 # ---------------- HANDLE CLIENT ----------------
-def handle_client(client_socket, address):
+async def handle_client(reader, writer):
+    address = writer.get_extra_info("peername")
     print(f"New connection from {address}")
-    with client_socket:
+    decoder = MessageDecoder()
+    try:
         while True:
-            try:
-                data = client_socket.recv(1024)  # Receive up to 1024 bytes
-                if not data:
-                    break
-                print(f"[{address}] Received: {data.decode('utf-8')}")
-            except ConnectionResetError:
+            data = await reader.read(4096)
+            if not data:
                 break
+            for message in decoder.feed(data):
+                print(f"[{address}] Received: {message}")
+    except ConnectionResetError:
+        pass
+    for message in decoder.flush():
+        print(f"[{address}] Received: {message}")
+    writer.close()
     print(f"Connection closed: {address}")
 
 # ---------------- SERVER ----------------
-def start_server():
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.bind((HOST, PORT))
-    server.listen()
+async def start_server():
+    server = await asyncio.start_server(handle_client, HOST, PORT)
     print(f"Server listening on {HOST}:{PORT}")
-
-    while True:
-        client_socket, address = server.accept()
-        thread = threading.Thread(target=handle_client, args=(client_socket, address), daemon=True)
-        thread.start()
+    async with server:
+        await server.serve_forever()
 
 if __name__ == "__main__":
-    start_server()
+    asyncio.run(start_server())
@@ -1,49 +1,111 @@
 import os
 import time
 import random
-#module for detection of microphone input
-import sounddevice as sd
 import numpy as np
 #module for creating the window and reading video files
 import cv2
 #module needed for creating queues to store incomig data from sockets
 import queue
-import socket
+import json
+import hashlib
+import re
+from collections import OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor
+import itertools
 import threading
+import asyncio
+import mmap
+import struct
+#framing of the trigger messages sent by midi_reader
+from midi_protocol import (MessageDecoder, TriggerMessage, encode_text, encode_binary,
+                           BINARY_HEADER, BUTTON_TYPES, MESSAGE_TYPES, VIDEO_EXT, normalize_tag)
+#folder watcher for hot reload
+from fs_watch import FolderWatcher
 
 # ---------------- CONFIG ----------------
 ### Screen
 WINDOW_NAME = "Camera :3"
 SCREEN_WIDTH = 350
 SCREEN_HEIGHT = 350
+### OUTPUT
+OUTPUT_SINK = "window"                  # "window", "v4l2", "shm", "file" or "null" (headless sinks need no GUI)
+V4L2_DEVICE = "/dev/video10"            # v4l2loopback device for the "v4l2" sink
+SHM_PATH = "/dev/shm/virtual_camera"    # Double-buffered shared-memory file for the "shm" sink
+FILE_SINK_PATH = "virtual_camera.bgr"   # Raw BGR frames for the "file" sink (a regular file or a named pipe)
 ### RULES
 ###### MIC 
 MIC_DEVICE_INDEX = 1
 ######### Options when detecting noise
-AUDIO_THRESHOLD_NOISE = 0.2
+AUDIO_THRESHOLD_NOISE = 0.2      # Level on the MIC_LEVEL_METRIC scale
 NOISE_DURATION = 0.0
 ######### Options when detecting silence
 AUDIO_THRESHOLD_SILENCE = 0.2
 SILENCE_DURATION = 1.0
+######### Level analysis (runs on the audio callback thread)
+MIC_BLOCK_SIZE = 256            # Samples per audio block, the resolution of the threshold/duration checks
+MIC_LEVEL_METRIC = "NORM"       # "NORM" (np.linalg.norm of the window, what the thresholds were tuned on), "RMS" or "PEAK"
+# NORM grows with the samples it covers: NORM = RMS * sqrt(samples). The thresholds above were tuned on
+# sounddevice's host-chosen block size, they mean the same with MIC_BLOCK_SIZE blocks only if the host
+# picked that size too. To switch to RMS, divide them by sqrt(MIC_BLOCK_SIZE) (0.2 -> 0.0125 for 256).
+MIC_WINDOW = 0.0                # Seconds of audio the level is computed over, 0 uses a single block
+MIC_HISTORY_BLOCKS = 512        # Audio blocks kept in the level ring buffer
 ###### MIDI
 HOST = '0.0.0.0'  # Listen on all network interfaces
 PORT = 5000       # Port to listen on
+######### Request scheduling
+REQUEST_COALESCE_WINDOW = 0.15  # Seconds a burst of requests is gathered before one of them is served
+REQUEST_MIN_INTERVAL = 0.5      # Minimum seconds between two served requests (emote switches)
+REQUEST_QUEUE_SIZE = 8          # Requests waiting at most, further ones drop the lowest priority request
+REQUEST_PRIORITIES = {}         # Tag -> priority, the highest priority request of a window wins (default 0)
 
 
 
 ### FRAMES
 VIDEO_END_CUTOFF = 20  # Number of frames before the actual end to consider the video finished
+GAPLESS_PLAYBACK = True           # Random and held clips hand over right after their last frame (False: VIDEO_END_CUTOFF frames early)
+### OUTPUT PACING
+OUTPUT_FPS = 30                   # Output frame rate, None follows the CAP_PROP_FPS of the playing clip
+SCHEDULER_SPIN = 0.002            # Seconds before a deadline where sleeping switches to spinning
+SCHEDULER_REPORT_INTERVAL = 10.0  # Seconds between pacing reports, 0 disables them
+### DECODE
+DECODE_THREADED = True            # Decode clips on a background thread into a ring of preallocated frames
+DECODE_RING_SIZE = 8              # Frames per decoder ring (one slot is always held by the render loop)
+DECODE_FIRST_FRAME_TIMEOUT = 1.0  # Seconds get_frame waits for the first frame of a newly opened clip
+DECODE_SCALER = "auto"            # "auto": scale inside a GStreamer pipeline when OpenCV has GStreamer, else "resize"
+RESIZE_INTERPOLATION = cv2.INTER_LINEAR  # Downscale filter (INTER_AREA is sharper for 4K sources, INTER_NEAREST fastest)
+###### CLIP POOL
+CLIP_POOL_ENABLE = True                       # Keep the next clip of every reachable state opened and pre-decoded
+CLIP_POOL_PREWARM_FRAMES = 4                  # Frames decoded ahead for each pre-warmed clip
+CLIP_POOL_MEMORY_BUDGET = 128 * 1024 * 1024   # Bytes of decoder rings the pool may hold before evicting
+###### CLIP CACHE
+CLIP_CACHE_ENABLE = False                     # Decode every clip once into a raw frame file and play it through np.memmap
+CLIP_CACHE_FOLDER = ".clip_cache"             # Folder holding the raw frame files
+CLIP_CACHE_MAX_BYTES = 4 * 1024 * 1024 * 1024 # Size cap of the cache folder, least recently used entries are evicted
+###### MEDIA INDEX
+MEDIA_INDEX_FILE = ".media_index.json"  # Folder listings and clip properties (frames, fps, size) kept between runs
+###### HOT RELOAD
+HOT_RELOAD_ENABLE = True          # Pick up added, removed and changed clips in the state folders while running
+HOT_RELOAD_DEBOUNCE = 0.5         # Seconds a folder has to be quiet before its changes are indexed
+###### PREPROCESSED CLIPS (preprocess_clips.py)
+PREPROCESS_FOLDER = "optimized"   # Subfolder of each state folder with the normalized clips and their manifest
+PREPROCESS_MANIFEST = "manifest.json"
+PREPROCESS_GOP = 10               # Keyframe interval of normalized clips, short GOPs make opening and seeking cheap
+PREPROCESS_CRF = 18               # x264 quality of normalized clips (lower is better)
 
 
 ### FILTERS
 ###### TRANSITION FILTERS
+TRANSITION_STYLE = "glitch"     # How clips change: "glitch", "crossfade" or "none"
 TRANSITION_FILTER_FRAMES = 5    # Number of frames glitch runs during a transition
+CROSSFADE_FRAMES = 8            # Number of frames the outgoing clip is blended into the incoming one
 ######### GLITCH
 GLITCH_ENABLE = True             # Enable/disable glitch filter
 GLITCH_SHIFT = 25               # Max horizontal shift for glitch bars
 GLITCH_BAR_MIN = 5              # Minimum number of glitch bars per frame
 GLITCH_BAR_MAX = 10             # Maximum number of glitch bars per frame
 BLUE_BOOST = 80                 # Intensity boost for blue channel in glitch
+GLITCH_SEED = None              # Seed of the glitch RNG, set an int for reproducible transitions
+GLITCH_PLAN_CACHE = 8           # Compiled glitch plans kept and reused by later transitions (0 = new plan every time)
 ###### REGULAR FILTERS
 ######### VHS wobble
 ENABLE_VHS = True
@@ -56,11 +118,232 @@ SCANLINE_SPACING = 4
 ######### Chromatic aberration
 ENABLE_CA = True
 CA_SHIFT = 4
+######### Color effects (applied after chromatic aberration, before scanlines)
+COLOR_EFFECTS_ENABLE = True
+# (effect, value) pairs applied in order and folded into one lookup table, e.g.
+# [("gamma", 1.2), ("tint", (1.0, 0.95, 1.1)), ("posterize", 8), ("brightness", 10)]
+# Effects: brightness (offset), offset (B, G, R offsets), gamma (>1 brightens), tint (B, G, R gains),
+# posterize (levels per channel), darken (offset subtracted)
+COLOR_EFFECTS = []
+###### FILTER ENGINE
+FUSED_FILTERS = True            # Run wobble/CA/color effects/scanlines as one fused pass over preallocated buffers
+FILTER_TILES = 4                # Horizontal bands the fused pass is split into, run on a thread pool (1 = serial)
+FILTER_MIN_TILE_ROWS = 32       # Bands are never made thinner than this
+
+### TRACING
+TRACE_ENABLE = True                     # Record latency spans across the input-to-photon path
+TRACE_CAPACITY = 16384                  # Spans kept in the ring buffer (oldest are overwritten)
+TRACE_DUMP_FILE = "latency_trace.json"  # Where the hotkey writes the summary and the raw spans
+TRACE_HOTKEY = ord("t")                 # Key in the window that prints and dumps the latency summary
+### INPUT RECORDING (replayed with replay_inputs.py)
+INPUT_RECORD_FILE = None                # File the MIC blocks and MIDI triggers are recorded to, None disables recording
+RANDOM_SEED = None                      # Seed of RNG (clip selection, glitch plans), set an int for reproducible sessions
 
 ### Global Variables
-FRAME_ENDED = False
-video_requests = queue.Queue()
-sm_video_request = queue.Queue()
+# Every random choice goes through this generator so a seeded session repeats itself
+RNG = random.Random(RANDOM_SEED)
+# Clip properties from the media index and the preprocessing manifests: path -> {"frames", "fps", ...}
+CLIP_INFO = {}
+# ---------------- LATENCY TRACING ----------------
+class LatencyTracer:
+    """
+    Low-overhead in-process span recorder. Spans go into preallocated numpy arrays used
+    as a ring buffer; recording is one counter increment and four array stores, safe
+    from any thread. summary() gives p50/p95/p99 per span name.
+    """
+    def __init__(self, capacity=TRACE_CAPACITY, enabled=TRACE_ENABLE):
+        self.capacity = capacity
+        self.enabled = enabled
+        self.names = []
+        self.name_ids = {}
+        # Guards name registration (rare, the hot path is a plain dict lookup) and the counters
+        self.lock = threading.Lock()
+        self.name_id = np.full(capacity, -1, dtype=np.int32)
+        self.start = np.zeros(capacity, dtype=np.float64)
+        self.duration = np.zeros(capacity, dtype=np.float64)
+        self.trace_id = np.zeros(capacity, dtype=np.int64)
+        # itertools.count is atomic under the GIL, so writers never share a slot
+        self.counter = itertools.count()
+        self.trace_ids = itertools.count(1)
+        # Event counters (e.g. emote misses), reported next to the spans
+        self.counters = Counter()
+
+    @staticmethod
+    def now():
+        return time.perf_counter()
+
+    def new_trace(self):
+        return next(self.trace_ids)
+
+    def record(self, name, start, end=None, trace_id=0):
+        if not self.enabled:
+            return
+        if end is None:
+            end = time.perf_counter()
+        name_id = self.name_ids.get(name)
+        if name_id is None:
+            with self.lock:
+                name_id = self.name_ids.get(name)
+                if name_id is None:
+                    name_id = len(self.names)
+                    self.names.append(name)
+                    self.name_ids[name] = name_id
+        i = next(self.counter) % self.capacity
+        self.start[i] = start
+        self.duration[i] = end - start
+        self.trace_id[i] = trace_id
+        self.name_id[i] = name_id
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def summary(self):
+        # name -> {count, p50, p95, p99, max} in milliseconds
+        summary = {}
+        for name_id, name in enumerate(list(self.names)):
+            durations = self.duration[self.name_id == name_id] * 1000.0
+            if durations.size == 0:
+                continue
+            p50, p95, p99 = np.percentile(durations, [50, 95, 99])
+            summary[name] = {"count": int(durations.size), "p50_ms": float(p50), "p95_ms": float(p95),
+                             "p99_ms": float(p99), "max_ms": float(durations.max())}
+        return summary
+
+    def print_summary(self):
+        print(f"{'span':<28}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for name, stats in self.summary().items():
+            print(f"{name:<28}{stats['count']:>8}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}"
+                  f"{stats['p99_ms']:>10.2f}{stats['max_ms']:>10.2f}")
+        with self.lock:
+            counters = sorted(self.counters.items())
+        for name, value in counters:
+            print(f"{name:<28}{value:>8}")
+
+    def dump(self, path=TRACE_DUMP_FILE):
+        valid = self.name_id >= 0
+        spans = [{"name": self.names[n], "start": float(s), "duration_ms": float(d * 1000.0), "trace": int(t)}
+                 for n, s, d, t in zip(self.name_id[valid], self.start[valid],
+                                       self.duration[valid], self.trace_id[valid])]
+        spans.sort(key=lambda span: span["start"])
+        with self.lock:
+            counters = dict(self.counters)
+        with open(path, "w") as f:
+            json.dump({"summary": self.summary(), "counters": counters, "spans": spans}, f, indent=1)
+        print(f"[LatencyTracer] Wrote {len(spans)} spans to {path}")
+
+
+TRACER = LatencyTracer()
+
+
+def seed_random(seed):
+    # Reseed RNG, players created afterwards also derive their glitch generator from it
+    RNG.seed(seed)
+
+
+# ---------------- INPUT RECORDING ----------------
+class InputRecorder:
+    """
+    Logs the inputs that drive the rules (level blocks from the MIC callback, trigger
+    messages from the MIDI server) with their time since the recording started, to a
+    compact binary file that replay_inputs.py feeds back into a headless state machine.
+    Callers only queue packed records; a writer thread does the file I/O so the audio
+    callback never waits on the disk.
+    """
+    MAGIC = b"VTIN"
+    VERSION = 2
+    FILE_HEADER = struct.Struct("<4sHd")    # magic, version, wall clock at the start
+    RECORD_HEADER = struct.Struct("<Bd")    # record type, seconds since the start
+    # Record types and their payloads
+    STREAM = 1                              # samplerate, block size
+    MIC_BLOCK = 2                           # sum of squares, samples, peak
+    TRIGGER = 3                             # midi_protocol binary frame
+    STREAM_FORMAT = struct.Struct("<dI")
+    MIC_BLOCK_FORMAT = struct.Struct("<dId")  # full precision levels, any block size
+
+    def __init__(self):
+        self.enabled = False
+        self.records = queue.SimpleQueue()
+        self.start = 0.0
+        self.file = None
+        self.writer = None
+
+    def open(self, path):
+        self.file = open(path, "wb")
+        self.file.write(self.FILE_HEADER.pack(self.MAGIC, self.VERSION, time.time()))
+        self.start = TRACER.now()
+        self.writer = threading.Thread(target=self.write_records, daemon=True)
+        self.writer.start()
+        self.enabled = True
+        print(f"[InputRecorder] Recording inputs to {path}")
+
+    def add(self, record_type, payload):
+        self.records.put(self.RECORD_HEADER.pack(record_type, TRACER.now() - self.start) + payload)
+
+    def stream(self, samplerate, blocksize):
+        self.add(self.STREAM, self.STREAM_FORMAT.pack(samplerate, blocksize))
+
+    def mic_block(self, sum_sq, samples, peak):
+        self.add(self.MIC_BLOCK, self.MIC_BLOCK_FORMAT.pack(sum_sq, samples, peak))
+
+    def trigger(self, message):
+        self.add(self.TRIGGER, encode_binary(message.tag, message.btn_type, message.timestamp))
+
+    def write_records(self):
+        while True:
+            record = self.records.get()
+            if record is None:
+                break
+            self.file.write(record)
+        self.file.close()
+
+    def close(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        self.records.put(None)
+        self.writer.join(timeout=2.0)
+        print(f"[InputRecorder] Recorded {TRACER.now() - self.start:.1f}s of inputs")
+
+    @classmethod
+    def read(cls, path):
+        # Yields (seconds since the start, record type, payload) for every complete record
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, started = cls.FILE_HEADER.unpack_from(data)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError(f"'{path}' is not an input recording (version {cls.VERSION})")
+
+        offset = cls.FILE_HEADER.size
+        try:
+            while offset < len(data):
+                record_type, t = cls.RECORD_HEADER.unpack_from(data, offset)
+                offset += cls.RECORD_HEADER.size
+                if record_type == cls.STREAM:
+                    payload = cls.STREAM_FORMAT.unpack_from(data, offset)
+                    offset += cls.STREAM_FORMAT.size
+                elif record_type == cls.MIC_BLOCK:
+                    payload = cls.MIC_BLOCK_FORMAT.unpack_from(data, offset)
+                    offset += cls.MIC_BLOCK_FORMAT.size
+                elif record_type == cls.TRIGGER:
+                    type_code, tag_length, timestamp = BINARY_HEADER.unpack_from(data, offset + 1)
+                    offset += 1 + BINARY_HEADER.size
+                    if offset + tag_length > len(data):
+                        break
+                    tag = data[offset:offset + tag_length].decode("utf-8", errors="replace")
+                    offset += tag_length
+                    btn_type = MESSAGE_TYPES[type_code] if type_code < len(MESSAGE_TYPES) else BUTTON_TYPES[0]
+                    payload = TriggerMessage(tag, btn_type, timestamp)
+                else:
+                    raise ValueError(f"Unknown record type {record_type} at byte {offset} of '{path}'")
+                yield t, record_type, payload
+        except struct.error:
+            # Recording cut off mid-record (the process was killed)
+            pass
+
+
+RECORDER = InputRecorder()
+
 # ---------------- STATE STRUCTURE ----------------
 class StateStruct:
     def __init__(self, name, video_random, videos=None, transitions=None):
@@ -70,6 +353,18 @@ class StateStruct:
         # transitions: list of tuples (next_state_name, rule_name, config_tuple)
         self.transitions = transitions if transitions else []
 
+    @property
+    def videos(self):
+        return self._videos
+
+    @videos.setter
+    def videos(self, videos):
+        # Every assignment (load, hot reload) rebuilds the tag -> clip index used by MIDI requests
+        self._videos = videos
+        self.clip_index = {}
+        for path in videos:
+            self.clip_index.setdefault(normalize_tag(path), path)
+
     def __repr__(self):
         return (
             f"StateStruct(name={self.name!r}, "
@@ -95,33 +390,511 @@ STATES = {
     "Emotes": StateStruct(
         name="Emotes",
         video_random=False,
-        transitions=[("Idle", "Inactivity", (None))]
+        transitions=[("Emotes", "MIDI", (None)),
+                     ("Idle", "Inactivity", (None))]
     ),
 }
 
+def copy_states(template=STATES):
+    # Fresh StateStructs with the same transitions, for a machine that loads its own videos
+    return {name: StateStruct(name=state.name, video_random=state.video_random,
+                              transitions=list(state.transitions))
+            for name, state in template.items()}
+
 # ---------------- AUTO-LOAD VIDEOS ----------------
 
-def auto_load_videos_into_states(state_map):
+def load_preprocess_manifest(folder_path):
+    """
+    Reads the manifest written by preprocess_clips.py for one state folder.
+    Returns (source file name -> normalized clip path, normalized clip path -> info).
+    Entries whose source changed since it was normalized are left out, the source is used
+    until preprocess_clips.py runs again.
+    """
+    manifest_path = os.path.join(folder_path, PREPROCESS_FOLDER, PREPROCESS_MANIFEST)
+    if not os.path.isfile(manifest_path):
+        return {}, {}
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Warning: could not read '{manifest_path}': {e}")
+        return {}, {}
+
+    replacements = {}
+    infos = {}
+    for source_name, entry in manifest.get("clips", {}).items():
+        output_path = os.path.join(folder_path, PREPROCESS_FOLDER, entry["output"])
+        if not os.path.isfile(output_path):
+            continue
+        try:
+            stat = os.stat(os.path.join(folder_path, source_name))
+        except OSError:
+            continue
+        if entry.get("source_size") != stat.st_size or entry.get("source_mtime") != stat.st_mtime:
+            print(f"[Preprocess] '{source_name}' changed since it was normalized, using the source clip")
+            continue
+        replacements[source_name] = output_path
+        infos[output_path] = {"frames": entry["frames"], "fps": entry["fps"], "duration": entry["duration"]}
+    return replacements, infos
+
+
+class MediaIndex:
+    """
+    Persistent index of the state folders. Folder listings are reused while the folder
+    mtime is unchanged, clip properties while the clip size and mtime are unchanged,
+    so a startup with nothing new is one JSON load and a few stat calls.
+    """
+    VERSION = 1
+
+    def __init__(self, path=MEDIA_INDEX_FILE):
+        self.path = path
+        self.folders = {}
+        self.clips = {}
+        self.dirty = False
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("version") == self.VERSION:
+            self.folders = data.get("folders", {})
+            self.clips = data.get("clips", {})
+
+    def save(self):
+        # Startup and the hot reload thread both save, the lock keeps them off each other's
+        # temp file and keeps the dicts still while they are serialized
+        with self.lock:
+            if not self.dirty:
+                return
+            data = {"version": self.VERSION, "folders": self.folders, "clips": self.clips}
+            try:
+                with open(self.path + ".tmp", "w") as f:
+                    json.dump(data, f)
+                os.replace(self.path + ".tmp", self.path)
+                self.dirty = False
+            except OSError as e:
+                print(f"[MediaIndex] Could not save '{self.path}': {e}")
+
+    def list_folder(self, folder_path, extensions):
+        # File names in the folder with one of the extensions, None if the folder does not exist
+        try:
+            mtime = os.stat(folder_path).st_mtime
+        except OSError:
+            return None
+        with self.lock:
+            entry = self.folders.get(folder_path)
+            if entry and entry["mtime"] == mtime:
+                return entry["files"]
+
+        files = sorted(f for f in os.listdir(folder_path) if f.lower().endswith(extensions))
+        with self.lock:
+            # Drop the clips that left the folder
+            present = {os.path.join(folder_path, f) for f in files}
+            for path in [p for p in self.clips if os.path.dirname(p) == folder_path and p not in present]:
+                del self.clips[path]
+            self.folders[folder_path] = {"mtime": mtime, "files": files}
+            self.dirty = True
+        return files
+
+    def clip_info(self, path):
+        # {"size", "mtime", "frames", "fps", "width", "height"}, probed again only when the file changed
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        with self.lock:
+            info = self.clips.get(path)
+        if info and info["size"] == stat.st_size and info["mtime"] == stat.st_mtime:
+            return info
+
+        cap = cv2.VideoCapture(path)
+        info = {"size": stat.st_size, "mtime": stat.st_mtime,
+                "frames": int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), "fps": cap.get(cv2.CAP_PROP_FPS),
+                "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))}
+        cap.release()
+        with self.lock:
+            self.clips[path] = info
+            self.dirty = True
+        return info
+
+
+def scan_state_folder(folder_path, index):
+    """
+    Videos of one state folder and their properties, as (paths, path -> info).
+    Returns (None, {}) if the folder does not exist.
+    """
+    files = index.list_folder(folder_path, VIDEO_EXT)
+    if files is None:
+        return None, {}
+    replacements, infos = load_preprocess_manifest(folder_path)
+    videos = []
+    for file in files:
+        path = replacements.get(file, os.path.join(folder_path, file))
+        # Preprocessed clips already have exact counts from their manifest
+        if path not in infos:
+            info = index.clip_info(path)
+            if info is None:
+                continue
+            infos[path] = info
+        videos.append(path)
+    return videos, infos
+
+
+def auto_load_videos_into_states(state_map, index=None, root=None):
     """
     Scans the subfolder with the same name as the state for video files.
     Example: folder 'Idle' contains 'Idle_1.mp4', 'Idle_hi.mov', etc.
+    Clips normalized by preprocess_clips.py are used in place of their sources.
+    Listings and clip properties come from the media index, CLIP_INFO is filled from it.
+    root: folder holding the state folders, the working directory by default.
     """
-    video_ext = (".mp4", ".mov", ".avi", ".mkv")
+    if index is None:
+        index = MediaIndex()
+    if root is None:
+        root = os.getcwd()
 
     for state_name, state_struct in state_map.items():
-        folder_path = os.path.join(os.getcwd(), state_name)
-        matched_files = []
+        folder_path = os.path.join(os.path.abspath(root), state_name)
+        matched_files, infos = scan_state_folder(folder_path, index)
 
-        if os.path.isdir(folder_path):
-            for file in os.listdir(folder_path):
-                if file.lower().endswith(video_ext):
-                    matched_files.append(os.path.join(folder_path, file))
-        else:
+        if matched_files is None:
             print(f"Warning: folder '{folder_path}' does not exist.")
+            matched_files = []
             exit
 
+        CLIP_INFO.update(infos)
         state_struct.videos = matched_files
 
+    index.save()
+    return index
+
+
+# ---------------- HOT RELOAD ----------------
+class StateReloader:
+    """
+    Watches the state folders (and their preprocessed clip folders). A change is
+    indexed on the watcher thread: only the changed folder is listed again, only new
+    or modified clips are probed, and new clips must decode a first frame before they
+    are offered. The render loop picks the finished video lists up with pending()
+    and swaps them in between frames.
+    """
+    def __init__(self, state_map, index, root=None):
+        self.index = index
+        # state folder -> state name
+        root = os.path.abspath(root if root is not None else os.getcwd())
+        self.folders = {os.path.join(root, name): name for name in state_map}
+        self.known = {name: set(state.videos) for name, state in state_map.items()}
+        # path -> (size, mtime) when its last change was handled
+        self.stats = {}
+        self.ready = queue.SimpleQueue()
+        watched = []
+        for folder in self.folders:
+            watched.append(folder)
+            optimized = os.path.join(folder, PREPROCESS_FOLDER)
+            if os.path.isdir(optimized):
+                watched.append(optimized)
+        self.watcher = FolderWatcher(watched, self.folder_changed, debounce=HOT_RELOAD_DEBOUNCE)
+
+    def start(self):
+        self.watcher.start()
+
+    def stats_changed(self, folder, names):
+        changed = False
+        for name in names:
+            path = os.path.join(folder, name)
+            try:
+                stat = os.stat(path)
+                current = (stat.st_size, stat.st_mtime)
+            except OSError:
+                current = None
+            if self.stats.get(path, False) != current:
+                self.stats[path] = current
+                changed = True
+        return changed
+
+    def folder_changed(self, folder, names):
+        # Runs on the watcher thread
+        changed_folder = folder
+        if folder not in self.folders:
+            folder = os.path.dirname(folder)
+        state_name = self.folders.get(folder)
+        if state_name is None:
+            return
+        if PREPROCESS_FOLDER in names and os.path.isdir(os.path.join(folder, PREPROCESS_FOLDER)):
+            self.watcher.add(os.path.join(folder, PREPROCESS_FOLDER))
+        # Some capture backends open files for writing while probing them, so a rejected clip
+        # reports a write of its own. Only react to files whose size or mtime really changed.
+        if not self.stats_changed(changed_folder, names):
+            return
+
+        videos, infos = scan_state_folder(folder, self.index)
+        if videos is None:
+            videos = []
+        known = self.known[state_name]
+        changed = {os.path.join(folder, name) for name in names} | {
+            os.path.join(folder, PREPROCESS_FOLDER, name) for name in names}
+        for path in [p for p in videos if p not in known or p in changed]:
+            if not self.decodes(path):
+                print(f"[HotReload] Skipping '{path}', no frame could be decoded")
+                videos.remove(path)
+        self.index.save()
+        self.known[state_name] = set(videos)
+        self.ready.put((state_name, videos, infos, (known - set(videos)) | (changed & known)))
+
+    @staticmethod
+    def decodes(path):
+        cap = cv2.VideoCapture(path)
+        ret = cap.isOpened() and cap.grab()
+        cap.release()
+        return ret
+
+    def pending(self):
+        # (state name, videos, path -> info, paths to drop from the pool) ready to apply
+        updates = []
+        while True:
+            try:
+                updates.append(self.ready.get_nowait())
+            except queue.Empty:
+                return updates
+
+    def stop(self):
+        self.watcher.stop()
+        self.watcher.join(timeout=2.0)
+
+
+# ---------------- Color Effects ---------------------
+def color_effect_table(effect, value):
+    """(256, 3) uint8 table of one effect, one column per B, G, R channel."""
+    x = np.repeat(np.arange(256, dtype=np.float64)[:, None], 3, axis=1)
+    if effect == "brightness":
+        x += value
+    elif effect == "offset":
+        x += np.asarray(value, dtype=np.float64)
+    elif effect == "darken":
+        x -= value
+    elif effect == "gamma":
+        x = 255.0 * (x / 255.0) ** (1.0 / value)
+    elif effect == "tint":
+        x *= np.asarray(value, dtype=np.float64)
+    elif effect == "posterize":
+        step = 255.0 / (max(2, int(value)) - 1)
+        x = np.rint(x / step) * step
+    else:
+        print(f"[ColorEffects] Unknown effect '{effect}', ignored")
+    return np.clip(np.rint(x), 0, 255).astype(np.uint8)
+
+
+def build_color_lut(effects):
+    """
+    Fold a stack of (effect, value) pairs into one (1, 256, 3) table for cv2.LUT.
+    Each effect is looked up through the previous ones, so the result equals applying
+    the effects one after another on uint8 frames. Returns None for an empty stack.
+    """
+    if not effects:
+        return None
+    lut = np.repeat(np.arange(256, dtype=np.uint8)[:, None], 3, axis=1)
+    channels = np.arange(3)
+    for effect, value in effects:
+        lut = color_effect_table(effect, value)[lut, channels]
+    return np.ascontiguousarray(lut[None])
+
+
+# ---------------- Filter Engine ---------------------
+class FilterEngine:
+    """
+    Fused VHS wobble -> chromatic aberration -> color effects -> scanlines chain.
+    The frame is treated as a single (height, width*3) plane so that the wobble and the
+    per-channel CA shifts collapse into one cv2.remap gather driven by precomputed index
+    maps. The color effects are one cv2.LUT pass and the scanlines one LUT pass over
+    the scanline rows.
+    Output is pixel-identical to running the individual Filters methods in sequence.
+    Every step is row-local, so with FILTER_TILES > 1 the frame is cut into horizontal
+    bands that run on a persistent thread pool; the result is identical to one band.
+    """
+    def __init__(self, screen_width, screen_height):
+        self.screen_width = screen_width
+        self.screen_height = screen_height
+        # Persistent worker threads for the tile-parallel mode, created on first use
+        self.pool = None
+        self.pool_size = 0
+        self.build(screen_width, screen_height)
+
+    def build(self, width, height):
+        self.width = width
+        self.height = height
+        shape = (height, width, 3)
+
+        # Two output buffers used alternately so the previously returned frame stays valid
+        self.outputs = [np.empty(shape, dtype=np.uint8) for _ in range(2)]
+        self.output_index = 0
+        self.tiles = None
+
+        # Every row is shifted by one of the values -max_shift..max_shift (truncated sine)
+        self.max_shift = int(abs(VHS_AMPLITUDE))
+        num_shifts = 2 * self.max_shift + 1
+        shift_values = np.arange(-self.max_shift, self.max_shift + 1)
+        ca = CA_SHIFT if ENABLE_CA else 0
+
+        # Column map for every (row shift, green source row shift) combination.
+        # Blue follows the row wobble, red the row wobble plus the CA shift and
+        # green the wobble of the row it is pulled from.
+        x = np.arange(width)
+        channel_cols = np.empty((num_shifts, num_shifts, width, 3), dtype=np.float32)
+        channel_cols[:, :, :, 0] = ((x[None, :] - shift_values[:, None]) % width * 3 + 0)[:, None, :]
+        channel_cols[:, :, :, 1] = ((x[None, :] - shift_values[:, None]) % width * 3 + 1)[None, :, :]
+        channel_cols[:, :, :, 2] = ((x[None, :] - shift_values[:, None] - ca) % width * 3 + 2)[:, None, :]
+        self.col_table = channel_cols.reshape(num_shifts * num_shifts, width * 3)
+
+        # Row map is constant: green comes from the row CA_SHIFT below, the others from the same row
+        rows = np.arange(height)
+        self.green_rows = (rows + ca) % height
+        map_y = np.empty((height, width, 3), dtype=np.float32)
+        map_y[:, :, 0] = rows[:, None]
+        map_y[:, :, 1] = self.green_rows[:, None]
+        map_y[:, :, 2] = rows[:, None]
+        self.map_y = map_y.reshape(height, width * 3)
+        self.map_x = np.empty((height, width * 3), dtype=np.float32)
+
+        # Per-frame wobble scratch
+        self.row_phase = rows / VHS_FREQ
+        self.phase = np.empty(height, dtype=np.float64)
+        self.row_shift = np.empty(height, dtype=np.intp)
+        self.green_shift = np.empty(height, dtype=np.intp)
+        self.combo = np.empty(height, dtype=np.intp)
+
+        # Without wobble the column map never changes
+        self.static_map_x = self.col_table[np.full(height, self.max_shift * num_shifts + self.max_shift)]
+
+        # Color effects and scanline darkening, folded into lookup tables
+        self.color_lut = build_color_lut(COLOR_EFFECTS) if COLOR_EFFECTS_ENABLE else None
+        self.scanline_lut = build_color_lut([("darken", SCANLINE_OPACITY)])
+
+    def update_wobble_shifts(self, t):
+        num_shifts = 2 * self.max_shift + 1
+        # Same float operations as Filters.apply_vhs_wobble so the truncated shifts match
+        np.add(self.row_phase, t * 8.0, out=self.phase)
+        np.sin(self.phase, out=self.phase)
+        np.multiply(self.phase, VHS_AMPLITUDE, out=self.phase)
+        self.row_shift[:] = self.phase  # truncating cast, same as astype(np.int32)
+        self.row_shift += self.max_shift
+        # Combination index = own row shift * num_shifts + shift of the green source row
+        np.take(self.row_shift, self.green_rows, out=self.green_shift)
+        np.multiply(self.row_shift, num_shifts, out=self.combo)
+        self.combo += self.green_shift
+
+    def update_wobble_map(self, t):
+        self.update_wobble_shifts(t)
+        np.take(self.col_table, self.combo, axis=0, out=self.map_x, mode='clip')
+        return self.map_x
+
+    # -------- Tiles --------
+    def tile_bounds(self):
+        # Row ranges of the bands, recomputed when FILTER_TILES or the frame size changes
+        tiles = max(1, min(FILTER_TILES, self.height // FILTER_MIN_TILE_ROWS))
+        if self.tiles is None or len(self.tiles) != tiles or self.tiles[-1][1] != self.height:
+            edges = np.linspace(0, self.height, tiles + 1).astype(int)
+            self.tiles = list(zip(edges[:-1], edges[1:]))
+        return self.tiles
+
+    def render_band(self, frame, out, start, stop, wobble):
+        """Run the whole chain on rows start..stop of out. Every step only writes its own rows."""
+        if ENABLE_VHS or ENABLE_CA:
+            if wobble:
+                map_x = self.map_x[start:stop]
+                np.take(self.col_table, self.combo[start:stop], axis=0, out=map_x, mode='clip')
+            else:
+                map_x = self.static_map_x[start:stop]
+            # The gather reads from the whole source plane (green comes from CA_SHIFT rows below)
+            plane = frame.reshape(self.height, self.width * 3)
+            cv2.remap(plane, map_x, self.map_y[start:stop], cv2.INTER_NEAREST,
+                      dst=out.reshape(self.height, self.width * 3)[start:stop])
+            if self.color_lut is not None:
+                cv2.LUT(out[start:stop], self.color_lut, dst=out[start:stop])
+        elif self.color_lut is not None:
+            # The lookup doubles as the copy into out
+            cv2.LUT(frame[start:stop], self.color_lut, dst=out[start:stop])
+        elif out is not frame:
+            np.copyto(out[start:stop], frame[start:stop])
+
+        if SCANLINE_ENABLE:
+            # Darken the scanline rows of this band only
+            first = -(-start // SCANLINE_SPACING) * SCANLINE_SPACING
+            rows = out[first:stop:SCANLINE_SPACING]
+            cv2.LUT(rows, self.scanline_lut, dst=rows)
+
+    def apply(self, frame, t=None, out=None):
+        # out: optional destination (e.g. an output sink's buffer), the engine's own buffers otherwise
+        if frame is None:
+            return None
+        if not (ENABLE_VHS or ENABLE_CA or SCANLINE_ENABLE or self.color_lut is not None):
+            return frame
+        if frame.shape[:2] != (self.height, self.width):
+            self.build(frame.shape[1], frame.shape[0])
+
+        if out is None or out.shape != frame.shape:
+            out = self.outputs[self.output_index]
+            self.output_index ^= 1
+
+        frame = np.ascontiguousarray(frame)
+        wobble = ENABLE_VHS
+        if wobble:
+            self.update_wobble_shifts(time.time() if t is None else t)
+
+        tiles = self.tile_bounds()
+        if len(tiles) == 1:
+            self.render_band(frame, out, 0, self.height, wobble)
+            return out
+
+        # Bands are independent: hand all but the first to the pool and render that one here.
+        # NumPy and OpenCV drop the GIL inside take/remap/LUT (color grade and scanlines) so the bands really overlap.
+        if self.pool is None or self.pool_size != len(tiles) - 1:
+            if self.pool is not None:
+                self.pool.shutdown(wait=True)
+            self.pool_size = len(tiles) - 1
+            self.pool = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="filter_tile")
+        jobs = [self.pool.submit(self.render_band, frame, out, start, stop, wobble) for start, stop in tiles[1:]]
+        self.render_band(frame, out, tiles[0][0], tiles[0][1], wobble)
+        for job in jobs:
+            job.result()
+        return out
+
+    def release(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+
+
+# ---------------- GLITCH PLANS ----------------
+class GlitchPlan:
+    """
+    Every bar of every frame of one glitch transition, compiled ahead of time.
+    bars holds one (y, height, red start column, green start column) row per bar,
+    the bars of frame i are bars[offsets[i]:offsets[i + 1]].
+    """
+    def __init__(self, bars, offsets):
+        self.bars = bars
+        self.offsets = offsets
+
+    @classmethod
+    def compile(cls, rng, frames, width, height):
+        counts = rng.integers(GLITCH_BAR_MIN, GLITCH_BAR_MAX + 1, frames)
+        offsets = np.zeros(frames + 1, dtype=np.intp)
+        np.cumsum(counts, out=offsets[1:])
+        total = int(offsets[-1])
+        # Same ranges as the old per-bar random.randint calls
+        y = rng.integers(0, height - 1, total)
+        h = rng.integers(1, np.minimum(10, height - y) + 1)
+        shift = rng.integers(-GLITCH_SHIFT, GLITCH_SHIFT + 1, total)
+        bars = np.stack([y, h, np.clip(shift, 0, width), np.clip(-shift, 0, width)], axis=1).astype(np.int32)
+        return cls(bars, offsets)
+
+    def frame_bars(self, index):
+        return self.bars[self.offsets[index]:self.offsets[index + 1]]
+
 
 # ---------------- Filters ---------------------
 class Filters:
@@ -134,31 +907,51 @@ class Filters:
         self.transition_filter_frames_remaining = 0
         self.TRANSITION_FILTER_TOTAL_FRAMES = TRANSITION_FILTER_FRAMES
 
-        # Last clean frame for glitch effect
-        self.LAST_CLEAN_FRAME = np.zeros((screen_height, screen_width, 3), dtype=np.uint8)
+        # Glitch plans: compiled bar sequences, a scratch frame they are applied to in place and
+        # a lookup table for the saturating blue boost
+        self.glitch_rng = np.random.default_rng(GLITCH_SEED if GLITCH_SEED is not None else RNG.getrandbits(64))
+        self.glitch_plans = []
+        self.glitch_plan = None
+        self.glitch_step = 0
+        self.glitch_frame = np.empty((screen_height, screen_width, 3), dtype=np.uint8)
+        self.glitch_lut = build_color_lut([("offset", (0, 0, BLUE_BOOST))])
 
-    # -------- Glitch --------
-    def generate_glitch_frame(self, base_frame):
-        base = base_frame.copy()
-        self.LAST_CLEAN_FRAME = base_frame.copy()
-        num_bars = random.randint(GLITCH_BAR_MIN, GLITCH_BAR_MAX)
+        # Fused wobble/CA/scanline chain
+        self.filter_engine = FilterEngine(screen_width, screen_height)
 
-        for _ in range(num_bars):
-            y = random.randint(0, self.screen_height - 2)
-            h = random.randint(1, min(10, self.screen_height - y))
-            shift = random.randint(-GLITCH_SHIFT, GLITCH_SHIFT)
+    # -------- Glitch --------
+    def next_glitch_plan(self):
+        height, width = self.glitch_frame.shape[:2]
+        # Fill the cache first, then replay cached plans
+        if len(self.glitch_plans) < GLITCH_PLAN_CACHE:
+            plan = GlitchPlan.compile(self.glitch_rng, self.TRANSITION_FILTER_TOTAL_FRAMES, width, height)
+            self.glitch_plans.append(plan)
+            return plan
+        if self.glitch_plans:
+            return self.glitch_plans[self.glitch_rng.integers(len(self.glitch_plans))]
+        return GlitchPlan.compile(self.glitch_rng, self.TRANSITION_FILTER_TOTAL_FRAMES, width, height)
 
+    def generate_glitch_frame(self, base_frame):
+        if base_frame.shape != self.glitch_frame.shape:
+            self.glitch_frame = np.empty_like(base_frame)
+            self.glitch_plans.clear()
+            self.glitch_plan = None
+        if self.glitch_plan is None or self.glitch_step >= len(self.glitch_plan.offsets) - 1:
+            self.glitch_plan = self.next_glitch_plan()
+            self.glitch_step = 0
+
+        # The source may be a decoder slot or a read-only memmap, so the bars go on a scratch copy
+        base = self.glitch_frame
+        np.copyto(base, base_frame)
+        for y, h, x_r, x_g in self.glitch_plan.frame_bars(self.glitch_step):
+            band = base[y:y+h]
             # Red channel
-            x_r = max(0, shift)
-            base[y:y+h, x_r:self.screen_width, 0] = 255
-
+            band[:, x_r:, 0] = 255
             # Green channel
-            x_g = max(0, -shift)
-            base[y:y+h, x_g:self.screen_width, 1] = 255
-
+            band[:, x_g:, 1] = 255
             # Blue channel boost
-            blue = base[y:y+h, :, 2].astype(np.int16) + BLUE_BOOST
-            base[y:y+h, :, 2] = np.clip(blue, 0, 255).astype(np.uint8)
+            cv2.LUT(band, self.glitch_lut, dst=band)
+        self.glitch_step += 1
 
         return base
 
@@ -167,11 +960,17 @@ class Filters:
         if not SCANLINE_ENABLE:
             return frame
         out = frame.copy()
-        for y in range(0, out.shape[0], SCANLINE_SPACING):
-            darkened = out[y:y+1].astype(np.int16) - SCANLINE_OPACITY
-            out[y:y+1] = np.clip(darkened, 0, 255).astype(np.uint8)
+        rows = out[::SCANLINE_SPACING]
+        cv2.LUT(rows, self.filter_engine.scanline_lut, dst=rows)
         return out
 
+    # -------- Color Effects --------
+    def apply_color_effects(self, frame):
+        lut = self.filter_engine.color_lut
+        if lut is None:
+            return frame
+        return cv2.LUT(frame, lut)
+
     # -------- Chromatic Aberration --------
     def apply_chromatic_aberration(self, frame):
         if not ENABLE_CA:
@@ -195,149 +994,1291 @@ class Filters:
         return out
 
     # -------- Apply All Filters --------
-    def apply_filters(self, frame):
-        if GLITCH_ENABLE and self.transition_filter_active:
-            frame = self.generate_glitch_frame(frame)
-            self.transition_filter_frames_remaining -= 1
-            if self.transition_filter_frames_remaining <= 0:
-                self.transition_filter_active = False
+    def apply_filters(self, frame, out=None):
+        # out: buffer the fused engine writes the result into (an output sink's frame buffer)
+        if frame is None:
+            return None
+
+        frame = self.apply_transition_filter(frame)
 
         # Apply other visual filters
+        if FUSED_FILTERS:
+            return self.filter_engine.apply(frame, out=out)
+
         frame = self.apply_vhs_wobble(frame)
         frame = self.apply_chromatic_aberration(frame)
+        frame = self.apply_color_effects(frame)
         frame = self.apply_scanlines(frame)
 
         return frame
 
 
+    def apply_transition_filter(self, frame):
+        # Glitch of a running state transition, the frame itself otherwise
+        if frame is None or not (GLITCH_ENABLE and self.transition_filter_active):
+            return frame
+        frame = self.generate_glitch_frame(frame)
+        self.transition_filter_frames_remaining -= 1
+        if self.transition_filter_frames_remaining <= 0:
+            self.transition_filter_active = False
+        return frame
+
     def start_transition_filter(self):
+        # The crossfade is run by the video player when the clip changes
+        if TRANSITION_STYLE != "glitch":
+            return
         self.transition_filter_active = True
         self.transition_filter_frames_remaining = self.TRANSITION_FILTER_TOTAL_FRAMES
+        self.glitch_plan = self.next_glitch_plan()
+        self.glitch_step = 0
+
+
+
+# ---------------- DECODER ----------------
+class FrameRing:
+    """
+    Fixed-size ring of preallocated, already-resized frames shared by one decoder
+    thread (producer) and the render loop (consumer).
+    The slot returned by the last pop stays valid until the next pop, so one slot
+    is always reserved for the consumer.
+    """
+    def __init__(self, capacity, width, height):
+        self.capacity = max(2, capacity)
+        self.frames = np.empty((self.capacity, height, width, 3), dtype=np.uint8)
+        self.frame_idx = np.zeros(self.capacity, dtype=np.int64)
+        self.read_pos = 0
+        self.write_pos = 0
+        self.count = 0
+        self.eof = False
+        self.stopped = False
+        # Frames the producer may buffer ahead, lowered while a clip sits pre-warmed in the pool
+        self.limit = self.capacity - 1
+        self.cond = threading.Condition()
+
+    # -------- Producer --------
+    def acquire_write(self):
+        # Wait for a free slot, returns None once the ring has been stopped
+        with self.cond:
+            while self.count >= self.limit and not self.stopped:
+                self.cond.wait()
+            if self.stopped:
+                return None
+            return self.write_pos
+
+    def commit(self, frame_idx):
+        with self.cond:
+            self.frame_idx[self.write_pos] = frame_idx
+            self.write_pos = (self.write_pos + 1) % self.capacity
+            self.count += 1
+            self.cond.notify_all()
+
+    def finish(self):
+        with self.cond:
+            self.eof = True
+            self.cond.notify_all()
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+
+    def set_limit(self, limit):
+        with self.cond:
+            self.limit = max(1, min(limit, self.capacity - 1))
+            self.cond.notify_all()
+
+    # -------- Consumer --------
+    def pop(self, timeout=0.0):
+        # Returns the slot index of the oldest decoded frame, or None if nothing is buffered
+        with self.cond:
+            if self.count == 0 and not self.eof and timeout > 0:
+                self.cond.wait_for(lambda: self.count > 0 or self.eof, timeout)
+            if self.count == 0:
+                return None
+            slot = self.read_pos
+            self.read_pos = (self.read_pos + 1) % self.capacity
+            self.count -= 1
+            self.cond.notify_all()
+            return slot
+
+    def exhausted(self):
+        return self.eof and self.count == 0
+
+
+GSTREAMER_AVAILABLE = re.search(r"GStreamer:\s*YES", cv2.getBuildInformation()) is not None
+
+# videoscale methods closest to the OpenCV interpolation flags
+GSTREAMER_SCALE_METHODS = {cv2.INTER_NEAREST: 0, cv2.INTER_LINEAR: 1, cv2.INTER_CUBIC: 3,
+                           cv2.INTER_AREA: 1, cv2.INTER_LANCZOS4: 3}
+
+
+class ScaledCapture:
+    """
+    Reads the frames of a clip at the output size into a caller-provided buffer.
+    With a GStreamer-enabled OpenCV the scaling runs inside the decode pipeline (before
+    the color conversion, so that also runs at the small size). Otherwise frames are
+    decoded into one reused source-size buffer and cv2.resize'd into the destination.
+    decode_time and resize_time accumulate the split in seconds.
+    """
+    def __init__(self, path, width, height, scaler=DECODE_SCALER, interpolation=RESIZE_INTERPOLATION):
+        self.width = width
+        self.height = height
+        self.interpolation = interpolation
+        self.decode_buffer = None
+        self.position = 0
+        self.decode_time = 0.0
+        self.resize_time = 0.0
+        self.scaled_in_decoder = False
+
+        cap = None
+        if scaler == "gstreamer" or scaler == "auto" and GSTREAMER_AVAILABLE:
+            cap = cv2.VideoCapture(self.gstreamer_pipeline(path), cv2.CAP_GSTREAMER)
+            if cap.isOpened():
+                self.scaled_in_decoder = True
+            else:
+                cap.release()
+                cap = None
+        if cap is None:
+            cap = cv2.VideoCapture(path)
+        self.cap = cap
+
+        # Preprocessed clips come with exact counts, the others are asked from the container
+        # (appsink does not report the clip length, so the GStreamer path opens it separately)
+        info = CLIP_INFO.get(path)
+        if info is not None:
+            self.total_frames = info["frames"]
+            self.fps = info["fps"]
+        else:
+            meta = cv2.VideoCapture(path) if self.scaled_in_decoder else cap
+            self.total_frames = int(meta.get(cv2.CAP_PROP_FRAME_COUNT))
+            self.fps = meta.get(cv2.CAP_PROP_FPS)
+            if meta is not cap:
+                meta.release()
+
+    def gstreamer_pipeline(self, path):
+        method = GSTREAMER_SCALE_METHODS.get(self.interpolation, 1)
+        return (f'filesrc location="{path}" ! decodebin ! videoscale method={method} add-borders=false ! '
+                f'video/x-raw,width={self.width},height={self.height},pixel-aspect-ratio=1/1 ! '
+                f'videoconvert ! video/x-raw,format=BGR ! appsink sync=false max-buffers=2')
+
+    def read(self, dst):
+        # Decode the next frame into dst (height, width, 3), returns False at the end of the clip
+        decode_start = TRACER.now()
+        if self.scaled_in_decoder:
+            ret, frame = self.cap.read(dst)
+            if ret and frame is not dst:
+                np.copyto(dst, frame)
+            self.decode_time += TRACER.now() - decode_start
+            TRACER.record("decode", decode_start)
+        else:
+            ret, frame = self.cap.read(self.decode_buffer)
+            if ret:
+                self.decode_buffer = frame
+                resize_start = TRACER.now()
+                self.decode_time += resize_start - decode_start
+                TRACER.record("decode", decode_start, resize_start)
+                cv2.resize(frame, (self.width, self.height), dst=dst, interpolation=self.interpolation)
+                self.resize_time += TRACER.now() - resize_start
+                TRACER.record("resize", resize_start)
+        if ret:
+            self.position += 1
+        return ret
+
+    def grab(self):
+        # Skip one frame without converting it
+        if not self.cap.grab():
+            return False
+        self.position += 1
+        return True
+
+    def release(self):
+        self.cap.release()
+
+
+class ClipDecoder(threading.Thread):
+    """
+    Decodes one clip on a background thread and resizes every frame straight into
+    the slots of its FrameRing. The render loop only dequeues.
+    """
+    def __init__(self, path, screen_width, screen_height, ring_size=DECODE_RING_SIZE, prefill=None):
+        super().__init__(daemon=True)
+        self.path = path
+        self.screen_width = screen_width
+        self.screen_height = screen_height
+        self.ring = FrameRing(ring_size, screen_width, screen_height)
+        # Only decode the first `prefill` frames until the clip is activated
+        if prefill is not None:
+            self.ring.set_limit(prefill)
+        self.total_frames = 0
+        self.fps = 0.0
+        self.frames_decoded = 0
+        self.underruns = 0
+        # Slot currently on screen, stays valid until the next pop
+        self.held_slot = None
+        self.capture = None
+        self.opened = threading.Event()
+        self.created_at = TRACER.now()
+
+    def run(self):
+        open_start = TRACER.now()
+        cap = ScaledCapture(self.path, self.screen_width, self.screen_height)
+        self.capture = cap
+        self.total_frames = cap.total_frames
+        self.fps = cap.fps
+        self.opened.set()
+        TRACER.record("capture_open", open_start)
+
+        frame_idx = 0
+        while True:
+            slot = self.ring.acquire_write()
+            if slot is None:
+                break
+            if not cap.read(self.ring.frames[slot]):
+                self.ring.finish()
+                break
+            self.ring.commit(frame_idx)
+            if frame_idx == 0:
+                TRACER.record("first_decoded_frame", self.created_at)
+            self.frames_decoded += 1
+            frame_idx += 1
+
+        cap.release()
+
+    def next_frame(self):
+        # Returns (ret, frame, frame_idx) for the render loop
+        # A freshly opened clip has nothing buffered yet, give the decoder a moment
+        timeout = DECODE_FIRST_FRAME_TIMEOUT if self.held_slot is None else 0.0
+        slot = self.ring.pop(timeout)
+        if slot is None:
+            if self.ring.exhausted():
+                return False, None, 0
+            # Underrun: the decoder fell behind, repeat the frame currently on screen
+            self.underruns += 1
+            if self.held_slot is None:
+                return True, None, 0
+            slot = self.held_slot
+        self.held_slot = slot
+        return True, self.ring.frames[slot], int(self.ring.frame_idx[slot])
+
+    def skip(self, count):
+        # Drop up to `count` already decoded frames without waiting, returns how many were dropped
+        skipped = 0
+        while skipped < count:
+            slot = self.ring.pop()
+            if slot is None:
+                break
+            self.held_slot = slot
+            skipped += 1
+        return skipped
+
+    def buffered(self):
+        # (frames ready, frames the ring can hold ahead)
+        return self.ring.count, self.ring.capacity - 1
+
+    def activate(self):
+        # Let a pre-warmed decoder fill its whole ring
+        self.ring.set_limit(self.ring.capacity - 1)
+
+    def stop(self):
+        # The thread exits after its current read; it owns its ring so nothing else waits on it
+        self.ring.stop()
+
+    def memory_bytes(self):
+        return self.ring.frames.nbytes
+
+    def decode_times(self):
+        # (seconds decoding, seconds resizing) so far
+        if self.capture is None:
+            return 0.0, 0.0
+        return self.capture.decode_time, self.capture.resize_time
+
+
+class CachedClip:
+    """
+    Plays a clip straight from its raw frame file in the ClipCache.
+    Frames are zero-copy slices of an np.memmap, there is no codec work at all.
+    Has the same interface as ClipDecoder so the player and the pool can use either.
+    """
+    def __init__(self, path, frames, fps):
+        self.path = path
+        self.frames = frames
+        self.total_frames = len(frames)
+        self.fps = fps
+        self.position = 0
+        self.frames_decoded = 0
+        self.underruns = 0
+
+    def start(self):
+        pass
+
+    def next_frame(self):
+        if self.position >= self.total_frames:
+            return False, None, 0
+        frame_idx = self.position
+        self.position += 1
+        return True, self.frames[frame_idx], frame_idx
+
+    def skip(self, count):
+        skipped = min(count, self.total_frames - self.position)
+        self.position += skipped
+        return skipped
+
+    def buffered(self):
+        remaining = self.total_frames - self.position
+        return remaining, remaining
+
+    def activate(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def join(self, timeout=None):
+        pass
+
+    def memory_bytes(self):
+        # Pages belong to the OS page cache, not to the pool budget
+        return 0
+
+    def decode_times(self):
+        return 0.0, 0.0
+
 
+class ClipCache:
+    """
+    Decoded-clip cache. Every clip is decoded once at the screen size into a raw
+    uint8 frame file (<key>.raw) with a small JSON sidecar (<key>.json). The key
+    includes the source size and mtime so an edited clip gets a new entry. The
+    total size is capped, least recently used entries are evicted first.
+    """
+    def __init__(self, screen_width, screen_height, folder=CLIP_CACHE_FOLDER, max_bytes=CLIP_CACHE_MAX_BYTES):
+        self.screen_width = screen_width
+        self.screen_height = screen_height
+        self.folder = folder
+        self.max_bytes = max_bytes
+        os.makedirs(folder, exist_ok=True)
+
+        # Clips waiting to be decoded by the builder thread
+        self.build_queue = queue.Queue()
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.stopped = False
+        self.builder = threading.Thread(target=self.builder_thread, daemon=True)
+        self.builder.start()
+
+    def key(self, path):
+        stat = os.stat(path)
+        ident = f"{os.path.realpath(path)}|{stat.st_size}|{stat.st_mtime_ns}|{self.screen_width}x{self.screen_height}"
+        return hashlib.sha1(ident.encode("utf-8")).hexdigest()[:20]
+
+    def entry_paths(self, key):
+        base = os.path.join(self.folder, key)
+        return base + ".raw", base + ".json"
+
+    def open(self, path):
+        # Returns a CachedClip for the clip, or None if it is not cached (yet)
+        try:
+            raw_path, meta_path = self.entry_paths(self.key(path))
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta["frames"] == 0:
+            return None
+
+        shape = (meta["frames"], meta["height"], meta["width"], 3)
+        frames = np.memmap(raw_path, dtype=np.uint8, mode="r", shape=shape)
+        # Mark as recently used for eviction
+        os.utime(meta_path)
+        return CachedClip(path, frames, meta["fps"])
+
+    def request(self, paths):
+        # Queue clips for decoding in the background, skips clips already cached or queued
+        for path in paths:
+            with self.lock:
+                if path in self.pending:
+                    continue
+                self.pending.add(path)
+            self.build_queue.put(path)
+
+    def builder_thread(self):
+        while True:
+            path = self.build_queue.get()
+            if path is None:
+                break
+            try:
+                self.build(path)
+            except (OSError, cv2.error) as e:
+                print(f"[ClipCache] Could not cache '{path}': {e}")
+            with self.lock:
+                self.pending.discard(path)
+
+    def build(self, path):
+        key = self.key(path)
+        raw_path, meta_path = self.entry_paths(key)
+        if os.path.exists(meta_path):
+            return
+
+        cap = ScaledCapture(path, self.screen_width, self.screen_height)
+        fps = cap.fps
+        frame = np.empty((self.screen_height, self.screen_width, 3), dtype=np.uint8)
+        frames = 0
+        with open(raw_path + ".tmp", "wb") as f:
+            while not self.stopped:
+                if not cap.read(frame):
+                    break
+                f.write(frame.data)
+                frames += 1
+        cap.release()
+        if self.stopped:
+            os.remove(raw_path + ".tmp")
+            return
+
+        meta = {"source": os.path.abspath(path), "frames": frames, "fps": fps,
+                "width": self.screen_width, "height": self.screen_height}
+        # Raw file first so a sidecar always points at complete frames
+        os.replace(raw_path + ".tmp", raw_path)
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(meta_path + ".tmp", meta_path)
+        print(f"[ClipCache] Cached {frames} frames of '{path}'")
+
+        self.remove_stale(meta["source"], key)
+        self.evict()
+
+    def entries(self):
+        # (last used, key, meta) for every complete entry
+        entries = []
+        for file in os.listdir(self.folder):
+            if not file.endswith(".json"):
+                continue
+            meta_path = os.path.join(self.folder, file)
+            try:
+                with open(meta_path, "r") as f:
+                    meta = json.load(f)
+                entries.append((os.path.getmtime(meta_path), file[:-len(".json")], meta))
+            except (OSError, ValueError):
+                continue
+        return entries
+
+    def remove(self, key):
+        for entry_path in self.entry_paths(key):
+            try:
+                os.remove(entry_path)
+            except OSError:
+                pass
+
+    def remove_stale(self, source, current_key):
+        # Older versions of the same clip (different size/mtime) are never hit again
+        for last_used, key, meta in self.entries():
+            if meta.get("source") == source and key != current_key:
+                self.remove(key)
+
+    def evict(self):
+        sized = []
+        total = 0
+        for last_used, key, meta in self.entries():
+            raw_path = self.entry_paths(key)[0]
+            size = os.path.getsize(raw_path) if os.path.exists(raw_path) else 0
+            sized.append((last_used, key, size))
+            total += size
+        for last_used, key, size in sorted(sized):
+            if total <= self.max_bytes:
+                break
+            # Clips already memory-mapped keep their pages until they are closed
+            self.remove(key)
+            total -= size
+
+    def release(self):
+        # Abandon the clip being decoded and stop the builder
+        self.stopped = True
+        self.build_queue.put(None)
+        self.builder.join(timeout=1.0)
+
+
+class ClipPool:
+    """
+    Keeps one pre-warmed ClipDecoder (opened, first frames decoded) for the next
+    candidate clip of every state reachable from the current one, so a state switch
+    only swaps the active decoder. Decoders are evicted least recently used first
+    once their rings exceed the memory budget.
+    """
+    def __init__(self, open_source,
+                 memory_budget=CLIP_POOL_MEMORY_BUDGET, prewarm_frames=CLIP_POOL_PREWARM_FRAMES):
+        # open_source(path, prefill) returns a started ClipDecoder or CachedClip
+        self.open_source = open_source
+        self.memory_budget = memory_budget
+        self.prewarm_frames = prewarm_frames
+        # path -> ClipDecoder, least recently used first
+        self.decoders = OrderedDict()
+        # state name -> path picked as that state's next clip
+        self.candidates = {}
+
+    def prepare(self, path):
+        if path in self.decoders:
+            self.decoders.move_to_end(path)
+            return
+        self.decoders[path] = self.open_source(path, self.prewarm_frames)
+        self.evict()
+
+    def evict(self):
+        # Always keep the most recently prepared decoder
+        while len(self.decoders) > 1 and self.memory_bytes() > self.memory_budget:
+            path, decoder = self.decoders.popitem(last=False)
+            decoder.stop()
+            for state_name, candidate in list(self.candidates.items()):
+                if candidate == path:
+                    del self.candidates[state_name]
+
+    def memory_bytes(self):
+        return sum(decoder.memory_bytes() for decoder in self.decoders.values())
+
+    def prewarm_state(self, state):
+        # Pick the state's next random clip ahead of time and start decoding it
+        if not state.video_random or not state.videos:
+            return
+        candidate = self.candidates.get(state.name)
+        if candidate not in state.videos:
+            candidate = RNG.choice(state.videos)
+            self.candidates[state.name] = candidate
+        self.prepare(candidate)
+
+    def take(self, state, video_list):
+        # Hand over the pre-warmed decoder picked for this state, or None if there is none
+        candidate = self.candidates.pop(state.name, None)
+        if candidate is None or candidate not in video_list:
+            return None, None
+        return candidate, self.decoders.pop(candidate, None)
+
+    def take_clip(self, path):
+        # Hand over the pre-warmed decoder of one given clip (the next pass of a looping clip), or None
+        return self.decoders.pop(path, None)
+
+    def forget(self, paths):
+        # Drop the pre-warmed decoders of clips that were removed or changed on disk
+        for path in paths:
+            decoder = self.decoders.pop(path, None)
+            if decoder is not None:
+                decoder.stop()
+        for state_name, candidate in list(self.candidates.items()):
+            if candidate in paths:
+                del self.candidates[state_name]
+
+    def release(self):
+        for decoder in self.decoders.values():
+            decoder.stop()
+        for decoder in self.decoders.values():
+            decoder.join(timeout=1.0)
+        self.decoders.clear()
+        self.candidates.clear()
 
 
 # ---------------- VIDEO PLAYER ----------------
 class VideoPlayer:
-    def __init__(self, screen_width, screen_height):
+    def __init__(self, screen_width, screen_height, clip_cache=None):
         self.screen_width = screen_width
         self.screen_height = screen_height
         self.current_video = None
         self.cap = None
+        # Set when the playing clip nears its end, read by the Inactivity rule
+        self.frame_ended = False
+        # Tags of requested clips, filled by the MIDI rule
+        self.video_request = queue.Queue()
+        # Background decoder of the active clip (DECODE_THREADED)
+        self.decoder = None
+        self.decode_underruns = 0
+        # Decode vs resize seconds of the clips already closed
+        self.decode_time = 0.0
+        self.resize_time = 0.0
+        # Resize destinations of the synchronous path
+        self.resize_buffers = [np.empty((screen_height, screen_width, 3), dtype=np.uint8) for _ in range(2)]
+        self.resize_index = 0
+        # Incremented whenever a new clip starts so the frame scheduler can restart its clock
+        self.clip_serial = 0
+        self.last_frame = None
+        # Frames of the playing clip after the one on screen, None while its length is unknown
+        self.frames_left = None
+        # Crossfade: the outgoing decoder keeps playing under the first frames of the new clip,
+        # blended into a preallocated buffer (a still of its last frame when it has nothing left)
+        self.fade_source = None
+        self.fade_frame = None
+        self.fade_remaining = 0
+        self.fade_total = 0
+        self.fade_still = np.empty((screen_height, screen_width, 3), dtype=np.uint8)
+        self.fade_buffer = np.empty((screen_height, screen_width, 3), dtype=np.uint8)
+        # Decoded clips memory-mapped from disk, possibly shared with other players of the same size
+        self.owns_clip_cache = clip_cache is None
+        if clip_cache is None and CLIP_CACHE_ENABLE and DECODE_THREADED:
+            clip_cache = ClipCache(screen_width, screen_height)
+        self.clip_cache = clip_cache
+        # Pre-warmed decoders for the clips that may play next
+        self.clip_pool = ClipPool(self.open_source) if CLIP_POOL_ENABLE and DECODE_THREADED else None
+
+    def open_source(self, path, prefill=None):
+        # Cached clips are served from their memory-mapped frame file, others get a decoder thread
+        if self.clip_cache:
+            cached = self.clip_cache.open(path)
+            if cached is not None:
+                return cached
+            self.clip_cache.request([path])
+        decoder = ClipDecoder(path, self.screen_width, self.screen_height, prefill=prefill)
+        decoder.start()
+        return decoder
+
+    def close_decoder(self, decoder):
+        decoder.stop()
+        self.decode_underruns += decoder.underruns
+        decode_time, resize_time = decoder.decode_times()
+        self.decode_time += decode_time
+        self.resize_time += resize_time
+
+    def open_clip(self, path, decoder=None):
+        # Stop the previous decoder/capture and start reading the new clip
+        if (TRANSITION_STYLE == "crossfade" and CROSSFADE_FRAMES > 0
+                and path is not None and self.last_frame is not None):
+            self.start_crossfade()
+        if self.decoder:
+            self.close_decoder(self.decoder)
+            self.decoder = None
+        if self.cap:
+            self.decode_time += self.cap.decode_time
+            self.resize_time += self.cap.resize_time
+            self.cap.release()
+            self.cap = None
+        self.clip_serial += 1
+        self.frames_left = None
+
+        if path is None:
+            return
+        if decoder is not None:
+            # Pre-warmed clip from the pool: just swap it in
+            decoder.activate()
+            self.decoder = decoder
+        elif DECODE_THREADED:
+            self.decoder = self.open_source(path)
+        else:
+            open_start = TRACER.now()
+            self.cap = ScaledCapture(path, self.screen_width, self.screen_height)
+            TRACER.record("capture_open", open_start)
 
     def select_new_video(self):
-        global sm_video_request
         # If no requests exist, do nothing
-        if sm_video_request.empty():
+        if self.video_request.empty():
             return
 
         # Pull the newest request and clear the queue
-        while not sm_video_request.empty():
-            requested_name = sm_video_request.get()
+        while not self.video_request.empty():
+            requested_name = self.video_request.get()
 
         print(f"[StateMachine] New video requested: {requested_name}")
 
         # Look for a matching file in the current state
-        matched = None
-        for v in self.current_state.videos:
-            if (requested_name.lower()+".mp4") == os.path.basename(v).lower():
-                matched = v
-                break
+        matched = self.current_state.clip_index.get(normalize_tag(requested_name))
 
         if matched is None:
-            print(f"[StateMachine] ERROR: No video found matching '{requested_name}'")
+            self.count_emote_miss(requested_name)
             return
 
         # Load matched file
-        if self.cap:
-            self.cap.release()
-
         self.current_video = matched
-        self.cap = cv2.VideoCapture(matched)
+        self.open_clip(matched)
         print(f"[StateMachine] Loaded video: {matched}")
+        self.prewarm_clips()
+
 
+    def count_emote_miss(self, requested_name):
+        TRACER.count("emote_miss")
+        TRACER.count(f"emote_miss.{self.current_state.name}.{normalize_tag(requested_name)}")
 
     def select_random_video(self, video_list):
         if video_list:
-            self.current_video = random.choice(video_list)
-            if self.cap:
-                self.cap.release()
-            self.cap = cv2.VideoCapture(self.current_video)
+            decoder = None
+            if self.clip_pool:
+                self.current_video, decoder = self.clip_pool.take(self.current_state, video_list)
+            if decoder is None:
+                self.current_video = RNG.choice(video_list)
+            self.open_clip(self.current_video, decoder)
             print(f"Selected video: {self.current_video}")
+            self.prewarm_clips()
         else:
             self.current_video = None
-            self.cap = None
+            self.open_clip(None)
             print("No videos available to play.")
 
-    def get_frame(self):
-        global FRAME_ENDED
-        if not self.cap:
+    def prewarm_clips(self):
+        # Keep the next clip of the current state and of every state reachable from it ready
+        if not self.clip_pool:
+            return
+        self.clip_pool.prewarm_state(self.current_state)
+        for next_state_name, rule_name, config in self.current_state.transitions:
+            if next_state_name in self.states:
+                self.clip_pool.prewarm_state(self.states[next_state_name])
+
+    def read_frame(self):
+        # Returns (ret, frame, frame_idx, total_frames) from the decoder ring or the capture
+        if not DECODE_THREADED:
+            frame_idx = self.cap.position
+            # Alternate between two persistent destinations so the frame on screen stays valid
+            self.resize_index ^= 1
+            frame = self.resize_buffers[self.resize_index]
+            ret = self.cap.read(frame)
+            return ret, frame if ret else None, frame_idx, self.cap.total_frames
+
+        ret, frame, frame_idx = self.decoder.next_frame()
+        return ret, frame, frame_idx, self.decoder.total_frames
+
+    def skip_frames(self, count):
+        # Advance the clip without returning the frames (used to drop frames and stay in sync)
+        if self.decoder:
+            return self.decoder.skip(count)
+        skipped = 0
+        while skipped < count and self.cap.grab():
+            skipped += 1
+        return skipped
+
+    def clip_fps(self):
+        # Native frame rate of the playing clip, 0 while unknown
+        if self.decoder:
+            return self.decoder.fps
+        if self.cap:
+            return self.cap.fps
+        return 0.0
+
+    def handover_frames(self):
+        # Frames left in a clip when the next one takes over
+        if not GAPLESS_PLAYBACK:
+            return VIDEO_END_CUTOFF
+        if TRANSITION_STYLE == "crossfade":
+            # The tail of the outgoing clip plays out under the fade
+            return CROSSFADE_FRAMES
+        return 0
+
+    def get_frame(self, advance=1):
+        # advance: source frames to step, 0 repeats the last frame and >1 drops frames
+        if not self.cap and not self.decoder:
             return None
 
-        frame_idx = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
-        total_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if advance <= 0 and self.last_frame is not None:
+            return self.last_frame
+        if advance > 1:
+            self.skip_frames(advance - 1)
+            if self.fade_source:
+                self.fade_source.skip(advance - 1)
+
+        held = not self.current_state.video_random and self.clip_held()
+        #Switch right after the last wanted frame of the clip instead of reading past it. The next
+        #clip was pre-decoded by the pool, so its first frame follows without a gap
+        handover = (self.frames_left is not None and self.frames_left <= self.handover_frames()
+                    and (held or self.current_state.video_random))
+        ret, frame = False, None
+        if not handover:
+            ret, frame, frame_idx, total_frames = self.read_frame()
+
+        if not ret:
+            if held:
+                #The emote button is still held (or latched): play the clip again instead of ending it
+                self.open_clip(self.current_video, self.clip_pool.take_clip(self.current_video) if self.clip_pool else None)
+            else:
+                #Trigger transition filter
+                self.start_transition_filter()
+                #Select another random video
+                self.select_random_video(self.current_state.videos)
+                self.frame_ended = False
+            #Read the first frame of the new video
+            if self.cap or self.decoder:
+                ret, frame, frame_idx, total_frames = self.read_frame()
+
+        #Use the position of the frame just read to detect if near end
+        self.frames_left = total_frames - 1 - frame_idx if ret and total_frames > 0 else None
+        near_end = self.frames_left is not None and self.frames_left < VIDEO_END_CUTOFF
+
+        if near_end and held:
+            #Decode the next pass of the held clip before this one runs out
+            if self.clip_pool:
+                self.clip_pool.prepare(self.current_video)
+        elif near_end and not self.current_state.video_random:
+            self.frame_ended = True
+            self.post_event("Inactivity")
+
+        frame = self.blend_crossfade(frame)
+        self.last_frame = frame
+        return frame
 
-        #Peek at the next frame without advancing: use cap.get to detect if near end
-        near_end = total_frames > 0 and frame_idx >= total_frames - VIDEO_END_CUTOFF
+    # -------- Crossfade --------
+    def start_crossfade(self):
+        # Called before the clip changes: keep the outgoing decoder running under the new clip
+        self.end_crossfade()
+        np.copyto(self.fade_still, self.last_frame)
+        self.fade_frame = self.fade_still
+        if self.decoder:
+            self.fade_source = self.decoder
+            self.decoder = None
+        self.fade_total = CROSSFADE_FRAMES
+        self.fade_remaining = CROSSFADE_FRAMES
+
+    def blend_crossfade(self, frame):
+        # Blend the outgoing clip into the incoming frame, the new clip's weight grows every frame
+        if self.fade_remaining <= 0 or frame is None:
+            return frame
+        if self.fade_source:
+            ret, outgoing, _ = self.fade_source.next_frame()
+            if ret and outgoing is not None:
+                self.fade_frame = outgoing
+        alpha = 1.0 - self.fade_remaining / (self.fade_total + 1)
+        cv2.addWeighted(frame, alpha, self.fade_frame, 1.0 - alpha, 0.0, dst=self.fade_buffer)
+        self.fade_remaining -= 1
+        if self.fade_remaining <= 0:
+            self.end_crossfade()
+        return self.fade_buffer
+
+    def end_crossfade(self):
+        self.fade_remaining = 0
+        if self.fade_source:
+            self.close_decoder(self.fade_source)
+            self.fade_source = None
+
+    def clip_held(self):
+        # Whether a requested (non random) clip should keep looping, see StateMachine
+        return False
+
+    def decode_stats(self):
+        # Fill level of the active decoder ring, underruns and decode vs resize time so far
+        stats = {"buffered": 0, "capacity": 0, "fill": 0.0,
+                 "underruns": self.decode_underruns, "frames_decoded": 0,
+                 "decode_seconds": self.decode_time, "resize_seconds": self.resize_time}
+        if self.decoder:
+            decode_time, resize_time = self.decoder.decode_times()
+            stats["decode_seconds"] += decode_time
+            stats["resize_seconds"] += resize_time
+            buffered, capacity = self.decoder.buffered()
+            stats["buffered"] = buffered
+            stats["capacity"] = capacity
+            stats["fill"] = buffered / capacity if capacity else 1.0
+            stats["underruns"] += self.decoder.underruns
+            stats["frames_decoded"] = self.decoder.frames_decoded
+        elif self.cap:
+            stats["decode_seconds"] += self.cap.decode_time
+            stats["resize_seconds"] += self.cap.resize_time
+            stats["frames_decoded"] = self.cap.position
+        return stats
 
-        ret, frame = self.cap.read()
+    def release(self):
+        if self.clip_pool:
+            self.clip_pool.release()
+        if self.clip_cache and self.owns_clip_cache:
+            self.clip_cache.release()
+        self.end_crossfade()
+        if self.decoder:
+            self.decoder.stop()
+            self.decoder.join(timeout=1.0)
+        if self.cap:
+            self.cap.release()
 
-        if not ret or near_end and self.current_state.video_random:
-            #Trigger transition filter
-            self.start_transition_filter()
-            #Select another random video
-            self.select_random_video(self.current_state.videos)
-            #Read the first frame of the new video
-            ret, frame = self.cap.read()
-            FRAME_ENDED = False
+# ---------------- OUTPUT SINKS ----------------
+class OutputSink:
+    """
+    Where finished frames go. Frames are BGR uint8 at the screen size.
+    Sinks that own their memory return it from frame_buffer() so the filters can
+    render straight into it; write() then only has to publish it.
+    """
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.frames = 0
+
+    def open(self):
+        pass
+
+    def frame_buffer(self):
+        return None
+
+    def write(self, frame):
+        raise NotImplementedError
+
+    def poll_key(self):
+        # Key pressed since the last frame, -1 when the sink has no input
+        return -1
+
+    def close(self):
+        pass
+
+
+class WindowSink(OutputSink):
+    def open(self):
+        # Create window to display the frames
+        cv2.namedWindow(WINDOW_NAME, cv2.WINDOW_NORMAL)
+        # Resize the window
+        cv2.resizeWindow(WINDOW_NAME, self.width, self.height)
+
+    def write(self, frame):
+        cv2.imshow(WINDOW_NAME, frame)
+        self.frames += 1
+
+    def poll_key(self):
+        return cv2.waitKey(1) & 0xFF
+
+    def close(self):
+        cv2.destroyWindow(WINDOW_NAME)
+
+
+class NullSink(OutputSink):
+    # Discards frames, for benchmarks and headless load tests
+    def write(self, frame):
+        self.frames += 1
+
+
+class FileSink(OutputSink):
+    # Appends raw BGR frames to a file or a named pipe (opening a pipe waits for its reader)
+    def __init__(self, width, height, path=FILE_SINK_PATH):
+        super().__init__(width, height)
+        self.path = path
+        self.file = None
+
+    def open(self):
+        self.file = open(self.path, "wb", buffering=0)
+
+    def write(self, frame):
+        try:
+            self.file.write(np.ascontiguousarray(frame).data)
+        except BrokenPipeError:
+            print(f"[FileSink] Reader of '{self.path}' went away, reopening")
+            self.file.close()
+            self.open()
+        self.frames += 1
+
+    def close(self):
+        if self.file:
+            self.file.close()
+
+
+class V4L2Sink(OutputSink):
+    """Writes raw BGR24 frames to a v4l2loopback device (Linux only)."""
+    VIDIOC_S_FMT = 0xC0D05605 if struct.calcsize("P") == 8 else 0xC0CC5605
+    V4L2_BUF_TYPE_VIDEO_OUTPUT = 2
+    V4L2_FIELD_NONE = 1
+    V4L2_COLORSPACE_SRGB = 8
+    V4L2_PIX_FMT_BGR24 = ord("B") | ord("G") << 8 | ord("R") << 16 | ord("3") << 24
+
+    def __init__(self, width, height, device=V4L2_DEVICE):
+        super().__init__(width, height)
+        self.device = device
+        self.fd = None
+
+    def open(self):
+        import fcntl
+        self.fd = os.open(self.device, os.O_RDWR)
+        frame_size = self.width * self.height * 3
+        # struct v4l2_format: type, (padding to the union alignment), v4l2_pix_format, rest of the union
+        layout = "I4x12I152x" if struct.calcsize("P") == 8 else "I12I152x"
+        fmt = struct.pack(layout, self.V4L2_BUF_TYPE_VIDEO_OUTPUT,
+                          self.width, self.height, self.V4L2_PIX_FMT_BGR24, self.V4L2_FIELD_NONE,
+                          self.width * 3, frame_size, self.V4L2_COLORSPACE_SRGB, 0, 0, 0, 0, 0)
+        fcntl.ioctl(self.fd, self.VIDIOC_S_FMT, fmt)
+
+    def write(self, frame):
+        os.write(self.fd, np.ascontiguousarray(frame).data)
+        self.frames += 1
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
 
-        if near_end:
-            FRAME_ENDED = True
 
-        if frame is not None:
-            frame = cv2.resize(frame, (self.screen_width, self.screen_height))
-        return frame
+class SharedMemorySink(OutputSink):
+    """
+    Double-buffered shared-memory frame output for OBS/ffmpeg style readers.
+    The file holds a header followed by two frame buffers. The filters render into
+    the back buffer (frame_buffer()), write() flips it to the front and bumps the
+    sequence number. Readers copy the front buffer and re-check the sequence.
+    """
+    # magic, version, width, height, channels, frame size, front buffer index, sequence
+    HEADER = struct.Struct("<4sIIIIQIQ")
+    HEADER_SIZE = 64
+    MAGIC = b"VTSH"
+
+    def __init__(self, width, height, path=SHM_PATH):
+        super().__init__(width, height)
+        self.path = path
+        self.frame_size = width * height * 3
+        self.map = None
+        self.buffers = []
+        self.front = 0
+        self.sequence = 0
+
+    def open(self):
+        size = self.HEADER_SIZE + 2 * self.frame_size
+        with open(self.path, "a+b") as f:
+            f.truncate(size)
+            self.map = mmap.mmap(f.fileno(), size)
+        self.buffers = [np.frombuffer(self.map, dtype=np.uint8, count=self.frame_size,
+                                      offset=self.HEADER_SIZE + i * self.frame_size).reshape(self.height, self.width, 3)
+                        for i in range(2)]
+        self.publish()
+
+    def publish(self):
+        self.HEADER.pack_into(self.map, 0, self.MAGIC, 1, self.width, self.height, 3,
+                              self.frame_size, self.front, self.sequence)
+
+    def frame_buffer(self):
+        return self.buffers[self.front ^ 1]
+
+    def write(self, frame):
+        back = self.buffers[self.front ^ 1]
+        # Frames rendered straight into the back buffer need no copy
+        if not np.shares_memory(frame, back):
+            np.copyto(back, frame)
+        self.front ^= 1
+        self.sequence += 1
+        self.publish()
+        self.frames += 1
+
+    def close(self):
+        if self.map:
+            self.buffers = []
+            try:
+                self.map.close()
+            except BufferError:
+                # A caller still holds a view of a buffer, the map goes with its last reference
+                pass
+
+
+OUTPUT_SINKS = {
+    "window": WindowSink,
+    "null": NullSink,
+    "file": FileSink,
+    "v4l2": V4L2Sink,
+    "shm": SharedMemorySink,
+}
 
+def open_output_sink(name, width, height):
+    sink = OUTPUT_SINKS[name](width, height)
+    sink.open()
+    return sink
 
 
-    def release(self):
-        if self.cap:
-            self.cap.release()
+# ---------------- FRAME SCHEDULER ----------------
+class FrameScheduler:
+    """
+    Paces the main loop on fixed deadlines instead of sleeping a fixed time after the work.
+    The output runs at OUTPUT_FPS (or the clip's own rate), and each clip is played on a
+    wall clock: frames_due() says how many source frames to step so slow ticks drop
+    frames and clips slower than the output duplicate them.
+    """
+    def __init__(self, fps=OUTPUT_FPS, clock=time.perf_counter):
+        self.fps = fps
+        self.clock = clock
+        self.next_deadline = None
+
+        # Clip clock
+        self.clip_serial = None
+        self.clip_start = 0.0
+        self.clip_frames = 0
+
+        # Stats
+        self.frames = 0
+        self.late_frames = 0
+        self.dropped_frames = 0
+        self.duplicated_frames = 0
+        self.jitter_total = 0.0
+        self.jitter_max = 0.0
+        self.last_report = clock()
+
+    def wait(self, clip_fps=0.0):
+        # Sleep until the next output deadline
+        fps = self.fps or clip_fps or 30.0
+        period = 1.0 / fps
+        now = self.clock()
+        if self.next_deadline is None:
+            self.next_deadline = now
+
+        remaining = self.next_deadline - now
+        if remaining > SCHEDULER_SPIN:
+            time.sleep(remaining - SCHEDULER_SPIN)
+        while self.clock() < self.next_deadline:
+            pass
+
+        now = self.clock()
+        jitter = now - self.next_deadline
+        self.jitter_total += jitter
+        self.jitter_max = max(self.jitter_max, jitter)
+        self.frames += 1
+
+        self.next_deadline += period
+        if now > self.next_deadline:
+            # Missed at least one whole deadline: skip them instead of bursting to catch up
+            self.late_frames += 1
+            missed = int((now - self.next_deadline) / period) + 1
+            self.next_deadline += missed * period
+
+    def frames_due(self, clip_serial, clip_fps):
+        # Number of source frames to step this tick, following the clip's wall clock
+        now = self.clock()
+        if clip_serial != self.clip_serial or clip_fps <= 0:
+            self.clip_serial = clip_serial
+            self.clip_start = now
+            self.clip_frames = 1
+            return 1
+
+        # Round to the nearest frame so timing noise at equal rates does not flip between 0 and 2
+        due = int((now - self.clip_start) * clip_fps + 0.5) + 1
+        advance = due - self.clip_frames
+        if advance <= 0:
+            self.duplicated_frames += 1
+            return 0
+        self.dropped_frames += advance - 1
+        self.clip_frames = due
+        return advance
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "late_frames": self.late_frames,
+            "dropped_frames": self.dropped_frames,
+            "duplicated_frames": self.duplicated_frames,
+            "jitter_mean_ms": 1000.0 * self.jitter_total / self.frames if self.frames else 0.0,
+            "jitter_max_ms": 1000.0 * self.jitter_max,
+        }
+
+    def report(self):
+        # Print the pacing stats every SCHEDULER_REPORT_INTERVAL seconds
+        if not SCHEDULER_REPORT_INTERVAL:
+            return
+        now = self.clock()
+        if now - self.last_report >= SCHEDULER_REPORT_INTERVAL:
+            self.last_report = now
+            stats = self.stats()
+            print(f"[FrameScheduler] frames={stats['frames']} late={stats['late_frames']} "
+                  f"dropped={stats['dropped_frames']} duplicated={stats['duplicated_frames']} "
+                  f"jitter mean={stats['jitter_mean_ms']:.2f}ms max={stats['jitter_max_ms']:.2f}ms")
+
 
 # ---------------- STATE MACHINE ----------------
 class StateMachine(VideoPlayer, Filters):
     def __init__(self, states, initial_state_name="Idle",
-                 screen_width=SCREEN_WIDTH, screen_height=SCREEN_HEIGHT):
-        VideoPlayer.__init__(self, screen_width, screen_height)
+                 screen_width=SCREEN_WIDTH, screen_height=SCREEN_HEIGHT,
+                 name="main", mic_device=MIC_DEVICE_INDEX, midi_port=PORT, clip_cache=None):
+        VideoPlayer.__init__(self, screen_width, screen_height, clip_cache)
         Filters.__init__(self, screen_width, screen_height)
+        # Inputs of this avatar (several machines can run side by side in the compositor)
+        self.name = name
+        self.mic_device = mic_device
+        self.midi_port = midi_port
         self.states = states
         self.video_random = False
         self.current_state = states[initial_state_name]
         self.new_video_requested = "none"
 
+        # Rule events pushed by the rule sources (mic stream, MIDI server, end of clip)
+        self.events = queue.SimpleQueue()
+        self.pending_events = set()
+        self.events_lock = threading.Lock()
+        # rule name -> (trace id, time the first pending event was posted)
+        self.event_origins = {}
+        # Input that caused the last switch, closed when its first frame is displayed
+        self.pending_trace = None
+        # state name -> {rule name -> [(next_state_name, callback_fn, config)]}
+        self.dispatch = self.compile_transitions()
+        # Set by mic_init
+        self.mic_meter = None
+        self.mic_stream = None
+        # Hot reload of the state folders, set up by main when HOT_RELOAD_ENABLE
+        self.reloader = None
+        # Coalesces and prioritizes the MIDI video requests
+        self.requests = RequestScheduler()
+
+        # Start decoding every clip into the cache in the background
+        if self.clip_cache:
+            for state in states.values():
+                self.clip_cache.request(state.videos)
+
         # Pick initial video
         self.select_random_video(self.current_state.videos)
 
+    def compile_transitions(self):
+        # Build the dispatch table once so an event only looks at the transitions it can trigger
+        callbacks = {r_name: callback_fn for r_name, init_fn, callback_fn in RULES}
+        dispatch = {}
+        for state_name, state in self.states.items():
+            table = {}
+            for next_state_name, rule_name, config in state.transitions:
+                if rule_name not in callbacks:
+                    print(f"[StateMachine] Unknown rule '{rule_name}' in state '{state_name}'")
+                    continue
+                table.setdefault(rule_name, []).append((next_state_name, callbacks[rule_name], config))
+            dispatch[state_name] = table
+        return dispatch
+
+    def post_event(self, rule_name, origin=None):
+        # Safe to call from any thread. Repeated events for a rule coalesce until the next update
+        # origin: time the input happened (defaults to now), used for input-to-photon tracing
+        with self.events_lock:
+            if rule_name in self.pending_events:
+                return
+            self.pending_events.add(rule_name)
+            self.event_origins[rule_name] = (TRACER.new_trace(), TRACER.now() if origin is None else origin)
+        self.events.put(rule_name)
+
+    def apply_reloads(self):
+        # Swap in the video lists the hot reloader finished indexing, between two frames
+        for state_name, videos, infos, dropped in self.reloader.pending():
+            state = self.states.get(state_name)
+            if state is None:
+                continue
+            CLIP_INFO.update(infos)
+            added = len(set(videos) - set(state.videos))
+            removed = len(set(state.videos) - set(videos))
+            state.videos = videos
+            if self.clip_pool:
+                self.clip_pool.forget(dropped)
+            print(f"[HotReload] {state_name}: {len(videos)} clips (+{added} -{removed})")
+        # The playing clip keeps playing; the next pick and the pool see the new lists
+        self.prewarm_clips()
+
     def update(self):
-        #Iterate through the transitions list in the current state and get the rules of transitioning
-        for next_state_name, rule_name, config in self.current_state.transitions:
-            #Iterate through the rules list and get the rules names and callback
-            for r_name, init_fn, callback_fn in RULES:
-                #If a rule for transition matches the one in the rules list
-                if r_name == rule_name:
-                    #Call the rule callback to see if the transition rule applies
-                    if config is None:
-                       result = callback_fn()
-                    else: 
-                        result = callback_fn(*config)
-                    #Check if the transition rule applies
-                    if result:
-                        #Trigger transition filter
-                        self.start_transition_filter()
-                        #Switch to the next state
-                        self.switch_state(next_state_name)
+        if self.reloader and not self.reloader.ready.empty():
+            self.apply_reloads()
+        # Only handle the events that were posted before this frame started
+        for _ in range(self.events.qsize()):
+            try:
+                rule_name = self.events.get_nowait()
+            except queue.Empty:
+                break
+            with self.events_lock:
+                self.pending_events.discard(rule_name)
+                origin = self.event_origins.pop(rule_name, None)
+            self.handle_event(rule_name, origin)
+
+    def handle_event(self, rule_name, origin=None):
+        #Look up the transitions of the current state that this rule can trigger
+        for next_state_name, callback_fn, config in self.dispatch[self.current_state.name].get(rule_name, ()):
+            #Call the rule callback to see if the transition rule applies
+            if config is None:
+                result = callback_fn(self)
+            else:
+                result = callback_fn(self, *config)
+            #Check if the transition rule applies
+            if result:
+                #Trigger transition filter
+                self.start_transition_filter()
+                #Switch to the next state
+                switch_start = TRACER.now()
+                self.switch_state(next_state_name)
+                if origin is not None:
+                    trace_id, origin_time = origin
+                    TRACER.record("switch_state", switch_start, trace_id=trace_id)
+                    self.pending_trace = (rule_name, trace_id, origin_time, self.clip_serial)
+                return
+
+    def frame_displayed(self):
+        # Close the input-to-photon span once the first frame of the switched-to clip is shown
+        if self.pending_trace is None:
+            return
+        rule_name, trace_id, origin_time, clip_serial = self.pending_trace
+        if self.clip_serial == clip_serial:
+            TRACER.record(f"input_to_photon.{rule_name}", origin_time, trace_id=trace_id)
+        self.pending_trace = None
 
     def switch_state(self, new_state_name):
-        global FRAME_ENDED
         #Validate that the new state is valid
         if new_state_name in self.states:
             #Set the current state as the new state
@@ -345,6 +2286,8 @@ class StateMachine(VideoPlayer, Filters):
             print(f"Switched to state: {new_state_name}")
             print(f"video_random: {self.current_state.video_random}")
             if self.current_state.video_random is True:
+                #Any emote that was playing is over
+                self.requests.deactivate()
                 #Load new video from new current state
                 self.select_random_video(self.current_state.videos)
             else:
@@ -354,150 +2297,430 @@ class StateMachine(VideoPlayer, Filters):
         else:
             print(f"State {new_state_name} not found. Switching to Idle state")
             #Set idle state as default
-            self.current_state = "Idle"
+            self.current_state = self.states["Idle"]
+            self.requests.deactivate()
             #Select video from idle state
             self.select_random_video(self.current_state.videos)
         #we switched to a new state and selected a new video. Reset flag
-        FRAME_ENDED = False
+        self.frame_ended = False
+        #Re-check the rules of the new state once: their sources may already hold a pending
+        #condition (e.g. a queued MIDI request) that was posted while another state was active
+        for rule_name in self.dispatch[self.current_state.name]:
+            self.post_event(rule_name)
+
+    def clip_held(self):
+        return self.requests.holding()
 
     def request_new_video(self, new_video):
         self.new_video_requested = new_video
 
+    def release(self):
+        # Stop the watcher, the decoders and the filter worker threads
+        if self.reloader:
+            self.reloader.stop()
+        VideoPlayer.release(self)
+        self.filter_engine.release()
 
 
 # ---------------- RULES ----------------
 ### MIC
-SOUND_DETECTED = False
-LAST_NOISE_TIME = 0.0
-VOLUME = 0.0
+###### Audio level meter
+class AudioLevelMeter:
+    """
+    Runs inside the sounddevice callback. Every block stores its sum of squares and
+    peak into preallocated ring buffers, computes the level over MIC_WINDOW and
+    evaluates the threshold + duration of every MIC rule config at audio-block
+    resolution on the stream's sample clock. When a config becomes satisfied it
+    calls on_change() so the state machine can react on its next frame.
+    The level analysis takes no lock, the render loop only reads plain attributes.
+    on_change() does: post_event takes the state machine's events_lock on the audio thread.
+    """
+    def __init__(self, configs, on_change, samplerate=48000.0,
+                 window=MIC_WINDOW, metric=MIC_LEVEL_METRIC, history=MIC_HISTORY_BLOCKS):
+        self.on_change = on_change
+        self.metric = metric
+        self.window = window
+        self.history = history
+        self.sum_sq = np.zeros(history, dtype=np.float64)
+        self.samples = np.zeros(history, dtype=np.int64)
+        self.peak = np.zeros(history, dtype=np.float64)
+        self.write_pos = 0
+        self.blocks = 0
+        self.sample_clock = 0
+        self.samplerate = samplerate
+        self.window_blocks = 1
+        self.level = 0.0
+
+        # config -> time the threshold started passing (None while it is not passing)
+        self.passing_since = {config: None for config in configs}
+        # config -> threshold held for the rule's duration
+        self.active = {config: False for config in configs}
+
+    def set_stream(self, samplerate, blocksize):
+        self.samplerate = samplerate
+        self.window_blocks = max(1, min(self.history, int(round(self.window * samplerate / blocksize))))
+
+    def InputStream_callback(self, indata, frames, time_info, status):
+        self.process(indata)
+
+    def process(self, indata):
+        samples = indata.reshape(-1)
+        sum_sq = float(np.dot(samples, samples))
+        peak = float(np.abs(samples).max()) if samples.size else 0.0
+        if RECORDER.enabled:
+            RECORDER.mic_block(sum_sq, samples.size, peak)
+        self.add_block(sum_sq, samples.size, peak)
+
+    def add_block(self, sum_sq, samples, peak):
+        # One block's statistics, from the stream or from a replayed recording
+        pos = self.write_pos
+        self.sum_sq[pos] = sum_sq
+        self.samples[pos] = samples
+        self.peak[pos] = peak
+        self.write_pos = (pos + 1) % self.history
+        self.blocks += 1
+        self.sample_clock += samples
+
+        self.level = self.window_level()
+        self.evaluate(self.sample_clock / self.samplerate)
+
+    def window_level(self):
+        # Level over the last window_blocks blocks of the ring
+        n = min(self.window_blocks, self.blocks)
+        start = self.write_pos - n
+        if start >= 0:
+            window = slice(start, self.write_pos)
+            sum_sq = self.sum_sq[window].sum()
+            samples = self.samples[window].sum()
+            peak = self.peak[window].max()
+        else:
+            sum_sq = self.sum_sq[start:].sum() + self.sum_sq[:self.write_pos].sum()
+            samples = self.samples[start:].sum() + self.samples[:self.write_pos].sum()
+            peak = max(self.peak[start:].max(), self.peak[:self.write_pos].max(initial=0.0))
+
+        if self.metric == "PEAK":
+            return float(peak)
+        if self.metric == "RMS":
+            return float(np.sqrt(sum_sq / samples)) if samples else 0.0
+        return float(np.sqrt(sum_sq))
+
+    def evaluate(self, now):
+        changed = False
+        for config, since in self.passing_since.items():
+            threshold, duration, threshold_type = config
+            if threshold_type == "POSITIVE":
+                threshold_passed = self.level >= threshold
+            else:
+                threshold_passed = self.level <= threshold
+
+            if not threshold_passed:
+                self.passing_since[config] = None
+                self.active[config] = False
+                continue
+            if since is None:
+                since = now
+                self.passing_since[config] = now
+            if not self.active[config] and now - since >= duration:
+                self.active[config] = True
+                changed = True
+
+        if changed:
+            self.on_change()
+
+    def is_active(self, config):
+        return self.active.get(tuple(config), False)
 
-###### Input Stream callback
-#This function is needed to update the detected volume level by Input Stream
-def InputStream_callback(indata, frames, time_info, status):
-    global VOLUME
-    #Save the volume level to a shared variable so the rule callback can access this value
-    VOLUME = np.linalg.norm(indata)
 
 ###### INIT 
-def mic_init():
-    #Start the Input Stream volume detection
-    sd.InputStream(device=MIC_DEVICE_INDEX, channels=1, callback=InputStream_callback).start()
+def create_mic_meter(sm):
+    #Every MIC config used by a transition is evaluated on the audio thread
+    configs = {tuple(config) for table in sm.dispatch.values()
+               for next_state_name, callback_fn, config in table.get("MIC", ())}
+    return AudioLevelMeter(configs, lambda: sm.post_event("MIC"))
+
+def mic_init(sm):
+    #module for detection of microphone input, imported here so tools that never open the microphone run without PortAudio
+    import sounddevice as sd
+    sm.mic_meter = create_mic_meter(sm)
+
+    #Start the Input Stream volume detection, keep a reference so the stream stays open
+    sm.mic_stream = sd.InputStream(device=sm.mic_device, channels=1, blocksize=MIC_BLOCK_SIZE,
+                                   callback=sm.mic_meter.InputStream_callback)
+    sm.mic_meter.set_stream(sm.mic_stream.samplerate, MIC_BLOCK_SIZE)
+    if RECORDER.enabled:
+        RECORDER.stream(sm.mic_stream.samplerate, MIC_BLOCK_SIZE)
+    sm.mic_stream.start()
 
 ###### CALLBACK
-def mic_callback(threshold, duration, threshold_type):
-    global SOUND_DETECTED, LAST_NOISE_TIME, VOLUME
-    result = False
-    threshold_passed = False
-
-    #Check the type of threshold that we need to use
-    if (threshold_type == "POSITIVE"):
-        #Check if the volume has passed the positive threshold
-        if (VOLUME >= threshold):
-            threshold_passed = True
-    elif (threshold_type == "NEGATIVE"):
-        #Check if the volume has passed the negative threshold
-        if (VOLUME <= threshold):
-            threshold_passed = True
-    
-
-    #If the threshold has passed
-    if (threshold_passed):
-        #Get current time
-        time_now = time.time()
-        #If this is the fist time detecting time
-        if (SOUND_DETECTED is False):
-            #Set sound detected flag
-            SOUND_DETECTED = True
-            #Record time when sound was detected
-            LAST_NOISE_TIME = time.time()
-        #Sound was already detected
-        else: 
-            #Check if sound has been going longer than rule's duration
-            if ((time_now - LAST_NOISE_TIME) > duration):
-                #Rule is valid
-                result = True
-                #Reset sound detected flag
-                SOUND_DETECTED = False
-    else:
-        #Clear flag as sound is no longer detected
-        SOUND_DETECTED = False
-    
-    return result
+def mic_callback(sm, threshold, duration, threshold_type):
+    #The level meter already checked the threshold and duration at audio rate
+    if sm.mic_meter is None:
+        return False
+    return sm.mic_meter.is_active((threshold, duration, threshold_type))
 
 ### Inactivity
 ###### INIT 
-def inactivity_init():
+def inactivity_init(sm):
+    #The video player posts the Inactivity event itself when the clip nears its end
     pass
 
 ###### CALLBACK
-def inactivity_callback():
-    global FRAME_ENDED
-    result = FRAME_ENDED  
+def inactivity_callback(sm):
+    result = sm.frame_ended
     return result
 
 ### MIDI
+###### Request scheduler
+class RequestScheduler:
+    """
+    Sits between the controller connections and the state machine so a burst of
+    presses becomes at most one emote switch. Requests arriving within
+    REQUEST_COALESCE_WINDOW are merged (highest priority wins, newest among equals)
+    and switches are at least REQUEST_MIN_INTERVAL apart.
+    Button types from the MIDI CSV:
+      Press  - hold: the emote loops while the button is down
+      Toggle - latch: the emote loops until the same button is pressed again
+    Letting go (Release, second Toggle press) only ends the loop: the pass on screen
+    plays out and the emote ends through Inactivity like any other clip.
+    submit() runs on the server thread, everything else on the render thread.
+    Listeners are called with feedback() whenever it changes.
+    """
+    def __init__(self, window=REQUEST_COALESCE_WINDOW, min_interval=REQUEST_MIN_INTERVAL,
+                 capacity=REQUEST_QUEUE_SIZE, priorities=REQUEST_PRIORITIES):
+        self.window = window
+        self.min_interval = min_interval
+        self.capacity = max(1, capacity)
+        self.priorities = {normalize_tag(tag): priority for tag, priority in priorities.items()}
+        self.lock = threading.Lock()
+        # (priority, arrival sequence, message) waiting for the current window to close. Messages of one
+        # chunk share their receive time, the sequence keeps them in arrival order
+        self.pending = []
+        self.sequence = itertools.count()
+        self.window_start = None
+        self.last_served = float("-inf")
+        # Tags of Press buttons currently down, the emote playing and the latched Toggle emote
+        self.held = set()
+        self.active = None
+        self.latched = None
+        self.stats = Counter()
+        # Time base of submit()/take(), replaced by the replay clock when inputs are replayed
+        self.clock = TRACER.now
+        self.listeners = []
+        self.notified = (None, False)
+
+    def submit(self, message, now):
+        # Returns the seconds until the state machine should look again, None if there is nothing to do
+        tag = normalize_tag(message.tag)
+        with self.lock:
+            self.stats["received"] += 1
+            if message.btn_type == "Release":
+                self.held.discard(tag)
+                return None
+            if message.btn_type == "Toggle" and self.active == tag and self.latched == tag:
+                # Second press of a latched Toggle stops the loop
+                self.latched = None
+            else:
+                return self.enqueue(tag, message, now)
+        # Only the latch changed, the pass on screen plays out
+        self.notify()
+        return None
+
+    def enqueue(self, tag, message, now):
+        # Called with the lock held
+        if message.btn_type == "Press":
+            self.held.add(tag)
+
+        priority = self.priorities.get(tag, 0)
+        seq = next(self.sequence)
+        if len(self.pending) >= self.capacity:
+            # Full: the lowest priority (oldest among equals) request goes, possibly the new one
+            lowest = min(self.pending, key=lambda request: request[:2])
+            self.stats["dropped"] += 1
+            TRACER.count("midi_request_dropped")
+            if (priority, seq) < lowest[:2]:
+                return self.due_in(now)
+            self.pending.remove(lowest)
+        self.pending.append((priority, seq, message))
+        if self.window_start is None:
+            self.window_start = now
+        return self.due_in(now)
+
+    def due_in(self, now):
+        if not self.pending:
+            return None
+        due = max(self.window_start + self.window, self.last_served + self.min_interval)
+        return max(0.0, due - now)
+
+    def take(self, now):
+        # The winning request once its window has closed, else None. It only becomes the
+        # playing emote once activate() is called for it
+        with self.lock:
+            # Timers may fire a little early
+            if not self.pending or self.due_in(now) > 0.005:
+                return None
+            priority, seq, message = max(self.pending, key=lambda request: request[:2])
+            self.stats["coalesced"] += len(self.pending) - 1
+            self.stats["served"] += 1
+            if len(self.pending) > 1:
+                TRACER.count("midi_request_coalesced", len(self.pending) - 1)
+            self.pending.clear()
+            self.window_start = None
+            self.last_served = now
+        return message
+
+    def activate(self, message):
+        # The state machine found a clip for the request and is switching to it
+        tag = normalize_tag(message.tag)
+        with self.lock:
+            self.active = tag
+            self.latched = tag if message.btn_type == "Toggle" else None
+        self.notify()
+
+    def holding(self):
+        with self.lock:
+            return self.active is not None and (self.active in self.held or self.active == self.latched)
+
+    def missed(self, message):
+        # The request had no clip: its button holds nothing, the emote playing (if any) is untouched
+        with self.lock:
+            self.held.discard(normalize_tag(message.tag))
+
+    def deactivate(self):
+        # The state machine left the emote on its own (clip ended)
+        with self.lock:
+            self.active = None
+            self.latched = None
+        self.notify()
+
+    def feedback(self):
+        # (tag of the emote playing or None, whether its Toggle latched it) for the controller LEDs
+        with self.lock:
+            return self.active, self.active is not None and self.active == self.latched
+
+    def notify(self):
+        # Called from the server thread (Toggle unlatch) and the render thread
+        with self.lock:
+            state = self.active, self.active is not None and self.active == self.latched
+            if state == self.notified:
+                return
+            self.notified = state
+        for listener in self.listeners:
+            listener(state)
+
 ###### Socket callback
-def handle_client(client_socket, address):
+async def handle_client(reader, writer, sm):
+    address = writer.get_extra_info("peername")
     print(f"New connection from {address}")
-    with client_socket:
+    #Frames messages across recv boundaries (text lines or binary frames)
+    decoder = MessageDecoder()
+    #Bring the new controller's LEDs up to date, later changes are pushed by send_feedback
+    sm.midi_clients.add(writer)
+    active, latched = sm.midi_feedback
+    if active is not None:
+        writer.write(encode_text(active, "Latched" if latched else "Playing"))
+    try:
         while True:
-            try:
-                data = client_socket.recv(1024)
-                if not data:
-                    break
-
-                message = data.decode('utf-8').strip()
-                print(f"[{address}] Received raw: {message}")
-
-                # Split by comma
-                parts = message.split(",", 1)   # split only once
-                first_param = parts[0].strip()
-
-                print(f"[{address}] Parsed video request: {first_param}")
-
-                # PUSH only first param to queue
-                video_requests.put(first_param)
-
-            except ConnectionResetError:
+            data = await reader.read(4096)
+            if not data:
                 break
-
+            received = TRACER.now()
+            queue_requests(decoder.feed(data), address, sm, received)
+            TRACER.record("socket_receive", received)
+    except ConnectionResetError:
+        pass
+    queue_requests(decoder.flush(), address, sm, TRACER.now())
+
+    sm.midi_clients.discard(writer)
+    writer.close()
     print(f"Connection closed: {address}")
 
-###### MIDI Server Thread
-def midi_server_thread(server):
-    while True:
-        client_socket, address = server.accept()
-        thread = threading.Thread(target=handle_client, args=(client_socket, address), daemon=True)
-        thread.start()
+def queue_requests(messages, address, sm, received):
+    #Hand every message of the chunk to the scheduler and wake the state machine when one is due
+    if not messages:
+        return
+    wall_now = time.time()
+    due = None
+    for message in messages:
+        if RECORDER.enabled:
+            RECORDER.trigger(message)
+        delay = sm.requests.submit(message, received)
+        if delay is not None:
+            due = delay if due is None else min(due, delay)
+        #midi_reader stamps each press with its wall clock (meaningful when both run on one host)
+        TRACER.record("reader_to_server", received - (wall_now - message.timestamp), received)
+    print(f"[{address}] Parsed video requests: {', '.join(f'{m.tag} ({m.btn_type})' for m in messages)}")
+    if due is None:
+        return
+    if due <= 0.0:
+        sm.post_event("MIDI", origin=received)
+    else:
+        #Look again when the coalescing window closes
+        asyncio.get_running_loop().call_later(due, lambda: sm.post_event("MIDI", origin=received))
+
+def send_feedback(sm, state):
+    #Runs on the server loop: tell every controller which emote is playing now, or which one stopped
+    active, latched = state
+    previous = sm.midi_feedback[0]
+    sm.midi_feedback = state
+    if active is not None:
+        data = encode_text(active, "Latched" if latched else "Playing")
+    elif previous is not None:
+        data = encode_text(previous, "Stopped")
+    else:
+        return
+    for writer in sm.midi_clients:
+        if not writer.is_closing():
+            writer.write(data)
 
 ###### INIT 
-def midi_init():
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.bind((HOST, PORT))
-    server.listen()
-    print(f"MIDI Server listening on {HOST}:{PORT}")
-
-    # Run server loop in its own thread
-    thread = threading.Thread(target=midi_server_thread, args=(server,), daemon=True)
+def midi_init(sm):
+    #No port: this machine takes no controller input
+    if sm.midi_port is None:
+        return
+    #One event loop serves every controller connection
+    loop = asyncio.new_event_loop()
+    #Bind here so a busy port is reported at startup
+    server = loop.run_until_complete(
+        asyncio.start_server(lambda reader, writer: handle_client(reader, writer, sm), HOST, sm.midi_port))
+    print(f"[{sm.name}] MIDI Server listening on {HOST}:{sm.midi_port}")
+
+    # Run the event loop in its own thread
+    sm.midi_server = server
+    #Emote changes happen on the render thread, the writes to the controllers on the loop
+    sm.midi_clients = set()
+    sm.midi_feedback = (None, False)
+    sm.requests.listeners.append(lambda state: loop.call_soon_threadsafe(send_feedback, sm, state))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
     thread.start()
 
 ###### CALLBACK
-def midi_callback():
-    global sm_video_request
-    result = False
-    try:
-        # Non-blocking pop
-        new_video = video_requests.get_nowait()
-        sm_video_request.put(new_video)
-        result = True
-
-    except queue.Empty:
-        return result  # Nothing to process
-
-    return result
+def midi_has_clip(sm, tag):
+    #Whether a state the MIDI rule can switch to from here has a clip for the tag
+    tag = normalize_tag(tag)
+    for next_state_name, callback_fn, config in sm.dispatch[sm.current_state.name].get("MIDI", ()):
+        state = sm.states.get(next_state_name)
+        if state is not None and tag in state.clip_index:
+            return True
+    return False
+
+def midi_callback(sm):
+    callback_start = TRACER.now()
+    message = sm.requests.take(sm.requests.clock())
+    if message is None:
+        return False  # Nothing to process
+    #Resolve the tag before switching: a missing clip must not latch or hold anything
+    if not midi_has_clip(sm, message.tag):
+        sm.count_emote_miss(message.tag)
+        sm.requests.missed(message)
+        return False
+    sm.requests.activate(message)
+    sm.video_request.put(message.tag)
+    TRACER.record("midi_callback", callback_start)
+    return True
 
 
 ### List of rules
+# (rule name, init_fn(sm) that connects the rule source to the state machine, callback_fn(sm, *config))
 RULES = [
     ("MIC", mic_init, mic_callback),
     ("Inactivity", inactivity_init, inactivity_callback),
@@ -506,35 +2729,66 @@ RULES = [
 
 # ---------------- TEST ----------------
 if __name__ == "__main__":
+    # Log the inputs for replay_inputs.py
+    if INPUT_RECORD_FILE:
+        RECORDER.open(INPUT_RECORD_FILE)
+
     # Load the videos
-    auto_load_videos_into_states(STATES)
+    media_index = auto_load_videos_into_states(STATES)
 
     sm = StateMachine(STATES)
 
+    # Watch the state folders for new, removed and changed clips
+    if HOT_RELOAD_ENABLE:
+        sm.reloader = StateReloader(STATES, media_index)
+        sm.reloader.start()
+
     # Initialize all rules
     for rule_name, init_fn, callback_fn in RULES:
         # Run the init function for the particular rule
-        init_fn() 
+        init_fn(sm)
 
-    # Create window to display the frames
-    cv2.namedWindow(WINDOW_NAME, cv2.WINDOW_NORMAL)
-    # Resize the window
-    cv2.resizeWindow(WINDOW_NAME, SCREEN_WIDTH, SCREEN_HEIGHT)
+    # Open the output (window or one of the headless sinks)
+    sink = open_output_sink(OUTPUT_SINK, SCREEN_WIDTH, SCREEN_HEIGHT)
 
-    # Main loop
-    while True:
-        # Update the state machine
-        sm.update()
-        # Get new frame
-        frame = sm.get_frame()
-        # Apply any filters to frame
-        frame = sm.apply_filters(frame)
-
-        # Display frame only if it is valid
-        if frame is not None:
-            cv2.imshow(WINDOW_NAME, frame)
-
-        # Check if user has pressed the esc key to close the program
-        if cv2.waitKey(30) & 0xFF == 27:
-            break
+    # Paces the loop on fixed output deadlines
+    scheduler = FrameScheduler()
 
+    # Main loop
+    try:
+        while True:
+            # Wait for the next output deadline
+            scheduler.wait(sm.clip_fps())
+            # Update the state machine
+            sm.update()
+            # Get new frame, dropping or repeating source frames to stay in sync with the wall clock
+            frame = sm.get_frame(scheduler.frames_due(sm.clip_serial, sm.clip_fps()))
+            # Apply any filters to frame, straight into the sink's buffer when it has one
+            filter_start = TRACER.now()
+            frame = sm.apply_filters(frame, out=sink.frame_buffer())
+            TRACER.record("filter_chain", filter_start)
+
+            # Output frame only if it is valid
+            if frame is not None:
+                display_start = TRACER.now()
+                sink.write(frame)
+                TRACER.record("display", display_start)
+                sm.frame_displayed()
+
+            scheduler.report()
+
+            key = sink.poll_key()
+            # Print and dump the latency summary
+            if key == TRACE_HOTKEY:
+                TRACER.print_summary()
+                TRACER.dump(TRACE_DUMP_FILE)
+            # Check if user has pressed the esc key to close the program
+            if key == 27:
+                break
+    except KeyboardInterrupt:
+        # Headless sinks have no window to press esc in
+        print("Exiting...")
+    finally:
+        sink.close()
+        sm.release()
+        RECORDER.close()